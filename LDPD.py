@@ -0,0 +1,326 @@
+import serial
+import serial.tools.list_ports
+import numpy as np
+import threading
+from collections import deque
+from time import sleep, monotonic
+
+from device_protocal import SOH, EOL, IDENTIFY, make_command
+from transport import serial_device
+
+# The laser module streams its readings as fixed size binary frames, framed like the OC's
+# messages (SOH, a message type of 'd', ..., CRLF) so the two can share a port monitor and
+# the text replies to commands can be picked out of the stream. All fields are little endian.
+frame_dtype = np.dtype([('soh', 'u1'),
+                        ('kind', 'u1'),
+                        ('seq', '<u2'),   # Counts frames, wrapping at 65536
+                        ('case', '<i2'),  # Case temperature [0.01 C]
+                        ('ld', '<i2'),    # LD temperature [0.01 C]
+                        ('pd', '<i4'),    # PD current [nA]
+                        ('tec', '<i2'),   # TEC drive [0.1 %]
+                        ('eol', '<u2')])  # CRLF
+DATA = b'd'
+frame_eol = int.from_bytes(EOL, 'little')
+
+# Fields kept for each sample, and the scale from the frame's units to the GUI's
+fields = ['time', 'case', 'ld', 'pd', 'tec'] # [s], [C], [C], [mA], [%]
+scales = {'case': 0.01, 'ld': 0.01, 'pd': 1e-6, 'tec': 0.1}
+
+
+def points_command(points):
+    # Command adding LD current points [uA, integers] to the end of the module's waveform
+    # table, which it plays at the point rate and then holds the last point of
+    return make_command('w', *points)
+
+
+def identify_port(port_name, baud=115200, timeout=1, write_timeout=1):
+    # Ask the device on port_name to describe itself. Returns the description if it is a
+    # laser module, or None. port_name may be the bare name the port lists give.
+    ser = serial.Serial(port=serial_device(port_name), baudrate=baud, timeout=timeout, write_timeout=write_timeout)
+    try:
+        ser.write(make_command('d', 0)) # Stop streaming, in case it was left on
+        sleep(0.1)
+        ser.reset_input_buffer()
+        ser.write(IDENTIFY)
+        out = ser.read_until(EOL)
+    finally:
+        ser.close()
+
+    if out.decode('utf-8', 'replace').find('LD') > 0:
+        return out.decode('utf-8', 'replace')
+    return None
+
+
+class SampleBuffer:
+    # Ring buffer of the last capacity samples, held in one preallocated NumPy array per
+    # field, so storing samples never creates a Python object per sample. count is the
+    # number of samples ever stored.
+
+    def __init__(self, capacity, fields):
+        self.capacity = capacity
+        self.data = {name: np.zeros(capacity) for name in fields}
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def clear(self):
+        self.count = 0
+
+    def extend(self, columns):
+        # Store a block of samples, given as an array per field
+        n = len(columns['time'])
+        skip = max(0, n - self.capacity) # Only the newest capacity samples can be kept
+        start = (self.count + skip) % self.capacity
+        first = min(n - skip, self.capacity - start)
+        for name, values in columns.items():
+            column = self.data[name]
+            column[start:start + first] = values[skip:skip + first]
+            column[:n - skip - first] = values[skip + first:]
+        self.count += n
+
+    def latest(self, name):
+        if self.count == 0:
+            return None
+        return self.data[name][(self.count - 1) % self.capacity]
+
+    def last(self, name, n=None):
+        # Copy of the last n samples of a field (all of them by default), oldest first
+        n = len(self) if n is None else min(n, len(self))
+        column = self.data[name]
+        start = (self.count - n) % self.capacity
+        if start + n <= self.capacity:
+            return column[start:start + n].copy()
+        return np.concatenate((column[start:], column[:start + n - self.capacity]))
+
+
+class LDPD:
+    version = 1.0
+
+    def __init__(self, port, baud=115200, capacity=65536) -> None:
+        # port is the serial port of the laser module, or "sim" for the simulator in
+        # ldpd_simulator.py
+        self.LDPD_description = []
+        self.LDPD_selected = ""
+        self.LDPD = serial.Serial() # Connection to the laser module
+        self.baud = baud
+        self.timeout = 1
+        self.write_timeout = 1
+        self.frame_size = frame_dtype.itemsize
+        self.device_max_rate = 1000 # Fastest the module can sample [Hz]
+        self.rate = 0 # Frames per second being streamed, 0 when not streaming
+        self.setpoint = None # LD temperature setpoint [C]
+        self.tec_fast = True
+        self.point_rate = 100 # LD current points played per second
+        self.write_lock = threading.Lock() # Held while writing, e.g. by a sweep worker
+        self.replies = deque(maxlen=100) # Text messages from the module, e.g. acks, oldest first
+        self.samples = SampleBuffer(capacity, fields)
+        self.read_buffer = bytearray(64 * 1024) # Bytes read from the port and not yet parsed
+        self.buff_end = 0
+        self.last_seq = None # seq of the last frame stored
+        self.seq_total = -1 # Frames since the start of the stream, counting lost ones, less one
+        self.frames_received = 0
+        self.frames_lost = 0 # Frames missing from the sequence, e.g. from an overrun
+        self.bytes_skipped = 0 # Bytes thrown away while finding the start of a frame
+        self.t_stream = None # monotonic time of the first frame of the stream
+
+        if port.strip().lower() == "sim":
+            from ldpd_simulator import LDPDSimulator
+            self.LDPD = LDPDSimulator(baud)
+            self.LDPD_selected = "sim"
+            self.LDPD_description.append("Simulated LD-PD module")
+            self.LDPD_open()
+            return
+
+        # Check the port passed exists and has a laser module on it
+        for entry in serial.tools.list_ports.comports():
+            if entry.name.lower() == port.strip().lower():
+                description = identify_port(entry.name, self.baud, self.timeout, self.write_timeout)
+                if description is not None:
+                    self.LDPD_selected = entry.name
+                    self.LDPD_description.append(description)
+                    self.setup_port()
+                    if self.LDPD_open():
+                        print("LD-PD module initialised successfully.")
+                    else:
+                        print("Error initialising LD-PD module.")
+                else:
+                    print("Error: No LD-PD module found on ", port.strip().upper())
+
+    def setup_port(self):
+        self.LDPD = serial.Serial()
+        self.LDPD.port = serial_device(self.LDPD_selected)
+        self.LDPD.baudrate = self.baud
+        self.LDPD.timeout = self.timeout
+        self.LDPD.write_timeout = self.write_timeout
+
+    def LDPD_open(self):
+        if not self.LDPD.is_open:
+            self.LDPD.open()
+        self.buff_end = 0
+        return self.LDPD.is_open
+
+    def LDPD_close(self):
+        if self.rate > 0:
+            self.stop_stream()
+        self.LDPD.close()
+
+############## Settings
+
+    def max_rate(self):
+        # Fastest frame rate the link can carry [Hz]. 10 bits per byte on the wire, with a
+        # tenth of the link left for the replies to commands.
+        return min(self.device_max_rate, int(0.9 * self.baud / 10 / self.frame_size))
+
+    def start_stream(self, rate=None):
+        # Stream frames at rate [Hz], by default as fast as the link allows
+        rate = self.max_rate() if rate is None else min(rate, self.max_rate())
+        self.samples.clear()
+        self.last_seq = None
+        self.t_stream = None
+        success = self.send_command(make_command('d', rate))
+        if success:
+            self.rate = rate
+        return success
+
+    def stop_stream(self):
+        success = self.send_command(make_command('d', 0))
+        if success:
+            self.rate = 0
+        return success
+
+    def set_temperature(self, temp):
+        # LD temperature setpoint [C]
+        success = self.send_command(make_command('s', "%3.3f" % temp))
+        if success:
+            self.setpoint = temp
+        return success
+
+    def set_tec_mode(self, fast):
+        # Fast or slow response of the TEC loop
+        success = self.send_command(make_command('t', 1 if fast else 0))
+        if success:
+            self.tec_fast = fast
+        return success
+
+    def set_point_rate(self, rate):
+        # Rate at which the waveform table is played [points/s]
+        success = self.send_command(make_command('r', int(rate)))
+        if success:
+            self.point_rate = int(rate)
+        return success
+
+    def set_modulation(self, frequency, amplitude):
+        # Sine modulation of the LD current, generated by the module on top of the waveform
+        # table. frequency [Hz], amplitude peak to peak [mA]
+        return self.send_command(make_command('f', int(frequency), int(round(amplitude * 1000))))
+
+    def send_points(self, points):
+        # Add LD current points [mA] to the waveform table
+        microamps = np.round(np.asarray(points) * 1000).astype(int)
+        return self.send_command(points_command(microamps))
+
+    def halt_current(self):
+        # Empty the waveform table and turn the LD current off straight away
+        return self.send_command(make_command('h'))
+
+    def send_command(self, cmd):
+        # Send the message to the module, making up to three attempts. Safe to call from
+        # more than one thread.
+        with self.write_lock:
+            for trying in range(3):
+                try:
+                    if self.LDPD.write(cmd) == len(cmd):
+                        return True
+                except Exception as e:
+                    if trying == 2:
+                        print("Error writing to the serial port\n")
+                        print(e)
+        return False
+
+############## Reading
+
+    def read_samples(self):
+        # Read whatever the module has sent, without blocking, and store the samples in it.
+        # Returns the number of new samples. The bytes are read straight into read_buffer,
+        # a buffer full at a time.
+        stored = 0
+        available = self.LDPD.in_waiting
+        while available > 0:
+            with memoryview(self.read_buffer) as view:
+                n = min(available, len(self.read_buffer) - self.buff_end)
+                self.buff_end += self.LDPD.readinto(view[self.buff_end:self.buff_end + n])
+            stored += self.parse_buffer()
+            available = self.LDPD.in_waiting if n > 0 else 0
+        return stored
+
+    def parse_buffer(self):
+        # Take every complete frame out of the read buffer. Runs of good frames are viewed
+        # as one structured array and checked and scaled a block at a time.
+        buffer = self.read_buffer
+        fs = self.frame_size
+        pos = 0
+        stored = 0
+        while pos < self.buff_end:
+            n = (self.buff_end - pos) // fs
+            if n > 0:
+                frames = np.frombuffer(buffer, frame_dtype, n, pos)
+                good = (frames['soh'] == SOH[0]) & (frames['kind'] == DATA[0]) & (frames['eol'] == frame_eol)
+                k = n if good.all() else int(np.argmin(good))
+                if k > 0:
+                    self.store(frames[:k])
+                    stored += k
+                    pos += k * fs
+                del frames, good
+                if k == n:
+                    continue
+
+            # Not at a whole data frame: an incomplete frame, a text reply, or noise
+            if buffer[pos:pos + 1] == SOH and buffer[pos + 1:pos + 2] in (DATA, b''):
+                if self.buff_end - pos < fs:
+                    break # The rest of the frame has not arrived yet
+            elif buffer[pos:pos + 1] == SOH:
+                end = buffer.find(EOL, pos, self.buff_end)
+                if end < 0:
+                    break
+                self.replies.append(bytes(buffer[pos + 1:end]))
+                pos = end + len(EOL)
+                continue
+            start = buffer.find(SOH, pos + 1, self.buff_end)
+            start = self.buff_end if start < 0 else start
+            self.bytes_skipped += start - pos
+            pos = start
+
+        self.shift_buffer(pos)
+        return stored
+
+    def store(self, frames):
+        # Work out each frame's time from its sequence number, so samples are evenly spaced
+        # however the bytes were bunched up on their way in
+        seq = frames['seq'].astype(np.int64)
+        if self.last_seq is None:
+            self.last_seq = seq[0] - 1
+            self.seq_total = -1
+            self.t_stream = monotonic()
+        steps = np.diff(seq, prepend=self.last_seq) % 65536
+        total = self.seq_total + np.cumsum(steps)
+        self.frames_lost += int(total[-1] - self.seq_total) - len(frames)
+        self.frames_received += len(frames)
+        self.last_seq = seq[-1]
+        self.seq_total = int(total[-1])
+
+        columns = {'time': self.t_stream + total / max(self.rate, 1)}
+        for name, scale in scales.items():
+            columns[name] = frames[name] * scale
+        self.samples.extend(columns)
+
+    def shift_buffer(self, shift):
+        if shift > 0:
+            self.read_buffer[:self.buff_end - shift] = self.read_buffer[shift:self.buff_end]
+            self.buff_end -= shift
+
+    def latest(self):
+        # The newest sample as a dict, or None before the first one
+        if self.samples.count == 0:
+            return None
+        return {name: float(self.samples.latest(name)) for name in fields}
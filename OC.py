@@ -1,79 +1,169 @@
 import serial
 import serial.tools.list_ports
-from datetime import datetime
-from collections import namedtuple
-from time import sleep
-
-from PyQt5 import QtWidgets
-
-
-
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QIcon
-from PyQt5.QtGui import QPixmap
-from PyQt5.QtGui import QFont
-from PyQt5.QtWidgets import (
-    QApplication,
-    QCheckBox,
-    QComboBox,
-    QDoubleSpinBox,
-    QLabel,
-    QLineEdit,
-    QListWidget, 
-    QMainWindow,
-    QSlider,
-    QSpinBox,
-    QWidget,
-    QVBoxLayout,
-    QHBoxLayout,
-    QGridLayout,
-    QPushButton,
-    QGroupBox,
-    QSlider,
-    QRadioButton,
-    QSystemTrayIcon,
-    QLCDNumber)
-
-import sys, os
-
-# import your OC class
-#from OC import OC
-
-basedir = os.path.dirname(__file__)
-
-
-class MainWindow(QtWidgets.QMainWindow):
-
-    def __init__(self):
-        super().__init__()
-
-        self.setWindowTitle("ABHEY OC Controller")
-        self.setGeometry(100, 100, 800, 600)
-        self.show()
+from collections import deque
+from itertools import count
+import heapq
+import threading
+
+from clock import system_clock
+from transport import PortParams, QtSerialTransport, make_transport, is_serial_port, serial_port_name
+
+
+# Write priorities, most urgent first. Writes waiting for the OC are sent in this order, 
+# so a safety command never queues behind routine traffic.
+PRIORITY_SAFETY = 0 # Turning the output or continuous output off
+PRIORITY_SETTING = 1 # Setpoint, ramp rate, enable, ...
+PRIORITY_POLL = 2 # Status requests
+
+# Commands that make the OC safe. They are sent with PRIORITY_SAFETY
+safety_commands = [b'!mxx0;1;\r', b'!nxx0;1;\r']
+
+# Continuous output. The OC pushes one status message per period, of about STATUS_BYTES.
+# A push rate is only accepted if it is a whole number of Hz up to MAX_PUSH_RATE and the
+# status messages take no more than LINK_SHARE of what the baud rate can carry, leaving
+# the rest for commands, their acks and the timing slack of a USB adapter.
+MAX_PUSH_RATE = 10 # [Hz]
+STATUS_BYTES = 32
+LINK_SHARE = 0.5
+# read_or_poll() falls back to asking for the status once no pushed message has arrived
+# for this long [s]
+PUSH_TIMEOUT = 2.5
+
+
+def link_push_rate(baud, share=LINK_SHARE):
+    # Fastest push rate [Hz] that keeps the status messages within share of a serial link,
+    # at 10 bits a byte (start, 8 data, stop)
+    return int(baud / 10 / STATUS_BYTES * share)
+
+
+def identify_port(port_name, baud=19200, data_bits=serial.EIGHTBITS, stop_bits=serial.STOPBITS_ONE,
+                  timeout=1, write_timeout=1, clock=system_clock):
+    # Ask the device on port_name to identify itself. Returns the description it sends back
+    # if it is an OC, or None if it is not.
+
+    # Open the port
+    ser = make_transport(port_name, PortParams(baud, data_bits, stop_bits, timeout=timeout,
+                                               write_timeout=write_timeout), clock)
+    ser.open()
+    try:
+        return identify(ser, clock)
+    finally:
+        # Close the port
+        ser.close()
+
+
+def identify(ser, clock=system_clock):
+    # As identify_port(), on a connection that is already open
+    ser.flush()
+    ser.write(b'!nxx00;1;\r')
+    clock.sleep(0.2) # The OC ignores writes less than 200 ms apart. Its ack arrives meanwhile.
+    while ser.inWaiting():
+        ser.readall()
+
+    ser.flush()
+    bytes_written = ser.write(b'!?;\r')
+
+    # Send the ID command and look for a return
+    if bytes_written != len(b'!?;\r'):
+        print("Serial write unsuccessful")
+    clock.sleep(0.2)
+    out = ser.read_until(expected = b'\r\n', size = 128)
+    if out.decode('utf-8') == "":
+        # try again
+        ser.flush()
+        ser.flush()
+        bytes_written = ser.write(b'!?\r')
+        clock.sleep(0.2)
+        out = ser.read_until(expected = b'\r\n', size = 128)
+
+    while out.decode('utf-8').find('+') > 0:
+        # acks are turned on, so read again until acks are flushed
+        out = ser.read_until(expected = b'\r\n', size = 128)
+
+    # Check the returned string for a valid description of an OC
+    if out.decode('utf-8').find('OC') > 0:
+        return out.decode('utf-8')
+    return None
+
+
+class PushStats:
+    # How the status messages pushed in continuous output mode are arriving, to see whether
+    # a push rate is sustained: the rate achieved, the messages that went missing, the gaps
+    # between them and how far the reader fell behind. Times are on clock, when the
+    # messages were parsed, so a late read shows as a gap even if nothing was lost. Started
+    # afresh each time continuous output is started.
+
+    def __init__(self, rate=0, clock=system_clock):
+        self.rate = rate # Requested [Hz]
+        self.clock = clock
+        self.t_start = clock.monotonic() # When the rate was set
+        self.frames = 0
+        self.first = None # clock time the first message was parsed
+        self.last = None # and the last
+        self.gaps = 0 # Intervals of more than 1.5 periods
+        self.longest = 0 # Longest interval [s]
+        self.backlog = 0 # Most bytes left waiting after a read
+        self.overruns = 0 # Times the OC's buffer overflowed and bytes were thrown away
+
+    def record(self, t):
+        if self.last is not None:
+            interval = t - self.last
+            self.longest = max(self.longest, interval)
+            if self.rate > 0 and interval > 1.5 / self.rate:
+                self.gaps += 1
+        else:
+            self.first = t
+        self.last = t
+        self.frames += 1
+
+    def achieved_rate(self):
+        # Messages a second since the rate was set [Hz], so messages that stop coming
+        # bring it down even before the next one arrives
+        elapsed = self.clock.monotonic() - self.t_start
+        if elapsed <= 0:
+            return 0
+        return self.frames / elapsed
+
+    def missed(self):
+        # Messages that should have arrived since the rate was set, but did not. One is
+        # allowed for where in the first period the stream started and one for a message
+        # still on its way, so a stream that stops, or never starts, counts as well as
+        # gaps between the messages that did arrive.
+        expected = int((self.clock.monotonic() - self.t_start) * self.rate)
+        missed = max(0, expected - 1 - self.frames)
+        if self.frames >= 2:
+            missed = max(missed, round((self.last - self.first) * self.rate) + 1 - self.frames)
+        return missed
+
+    def summary(self):
+        return {"rate": self.rate,
+                "achieved": round(self.achieved_rate(), 3),
+                "frames": self.frames,
+                "missed": self.missed(),
+                "gaps": self.gaps,
+                "longest_gap": round(self.longest, 3),
+                "backlog": self.backlog,
+                "overruns": self.overruns}
 
 
 class OC:
     version = 1.0
 
-    def __init__(self, port) -> None:
+    def __init__(self, port, clock=None) -> None:
+        # port is the serial port of the OC, any other port make_transport() in transport.py
+        # takes (qt:COM3, pty:/dev/pts/4, tcp://host:port), or "sim" for the simulator in
+        # oc_simulator.py.
+        # All timing (write pacing, timeouts, status ages, message times) is taken from
+        # clock, by default the real time. Pass a clock.VirtualClock to run against the 
+        # simulator without waiting.
+        self.clock = system_clock if clock is None else clock
         
-        self.port_params = namedtuple('port_params',['baud',
-                                                    'data_bits',
-                                                    'stop_bits',
-                                                    'parity',
-                                                     'timeout',
-                                                     'write_timeout'])
+        self.port_params = PortParams()
         self.OC_description = []
         self.OC_selected = ""
-        self.OC = serial.Serial() # Connection to the OC
-        self.port_params.baud = 19200
-        self.port_params.data_bits = serial.EIGHTBITS
-        self.port_params.stop_bits = serial.STOPBITS_ONE
-        self.port_params.parity = serial.PARITY_EVEN
-        self.port_params.timeout = 1
-        self.port_params.write_timeout = 1
+        self.OC = serial.Serial() # Connection to the OC, a transport (see transport.py) once selected
         self.fault_code = (0,"") 
-        self.fault_queue = []
+        self.fault_queue = deque(maxlen=1000) # Faults seen, oldest first. Only the latest are kept
         self.buff_length = 1024
         self.local_buffer = bytearray(self.buff_length)
         self.buff_end = 0 # The index of the last useful part of the local_buffer
@@ -86,8 +176,58 @@ class OC:
         self.setpoint = (0,"")
         self.temperature = (0,"")
         self.enable_state = []
+        self.status_max_age = 0.5 # Oldest status [s] the getters will return before querying the device again
+        self.status_time = None # monotonic time at which the last status message was parsed
+        self.status_listeners = [] # Called with the OC after each status message is parsed
+        self.status_lock = threading.Lock() # Held while a status request is in flight
+        self.write_interval = 0.3 # The OC requires at least 200 ms between writes [s]
+        self.last_write_time = None # monotonic time of the last write to the OC
+        self.pending = {} # Queued commands by parameter, as (priority, sequence, command)
+        self.pending_order = [] # Heap of (priority, sequence, parameter) over pending
+        self.sequence = count() # Orders commands of equal priority, oldest first
+        self.write_turn = threading.Condition() # Taken in turn by threads writing to the OC
+        self.writers = [] # Heap of (priority, sequence) of the threads waiting to write
+        self.waiting = {} # The command each of the writers is waiting to send
+        self.cancelled = set() # writers overridden by a safety command, see send_safety()
+        self.safety_latency = (None, 0) # Last and longest time from a safety command being called to it being written [s]
+        self.shadow = {} # Settings the OC has confirmed, see update_shadow()
+        self.unacked = deque(maxlen=16) # Commands sent and not yet acknowledged, oldest first
+        self.push_rate = 1 # Continuous output rate [Hz] and channel (oven) used by set_continuous_output()
+        self.push_channel = 1
+        self.push_stats = PushStats(clock=self.clock) # Arrival of the pushed status messages, see PushStats
         
 
+        if port.strip().lower() == "sim":
+            from oc_simulator import OCSimulator
+            self.OC = OCSimulator(self.clock)
+            self.OC_selected = "sim"
+            self.OC_description.append("Simulated OC")
+            self.OC_open()
+            return
+
+        if not is_serial_port(port):
+            # Not listed as a serial port, so just try it
+            self.OC_selected = port.strip()
+            self.setup_port()
+            try:
+                self.OC.open()
+                description = identify(self.OC, self.clock)
+                self.OC.close()
+            except (OSError, serial.SerialException) as e:
+                print("Error: Could not connect to", self.OC_selected, e)
+                self.OC_selected = ""
+                return
+            if description is not None:
+                self.OC_description.append(description)
+                if self.OC_open():
+                    print("OC controller initialised successfully.")
+                else:
+                    print("Error initialising OC controller.")
+            else:
+                print("Error: No OC controller found on", self.OC_selected)
+                self.OC_selected = ""
+            return
+
         # Check the port passed exists 
         # Get port list
         port_list = serial.tools.list_ports.comports()
@@ -95,50 +235,22 @@ class OC:
         if len(port_list) > 0:
             
             for entry in port_list:
-                if entry.name.lower() == port.strip().lower():
+                if entry.name.lower() == serial_port_name(port).lower():
                     # Check if the device really is an OC
-                    #    Open the port
-                    ser = serial.Serial()
-                    ser.baudrate = self.port_params.baud
-                    ser.port = entry.name
-                    ser.bytesize = self.port_params.data_bits
-                    ser.stopbits = self.port_params.stop_bits
-                    ser.timeout = self.port_params.timeout
-                    ser.write_timeout = self.port_params.write_timeout
-                    ser.open()
-                    ser.flush()
-                    ser.write(b'!nxx00;1;\r')
-                    while ser.inWaiting():
-                        ser.readall()
-                        
-                    ser.flush()
-                    bytes_written = ser.write(b'!?;\r')
-                    
-                    # Send the ID command and look for a return
-                    if bytes_written != len(b'!?;\r'):
-                        print("Serial write unsuccessful")
-                    sleep(0.2)
-                    out = ser.read_until(expected = b'\r\n', size = 128)
-                    if out.decode('utf-8') == "":
-                        # try again
-                        ser.flush()
-                        ser.flush()
-                        bytes_written = ser.write(b'!?\r')
-                        sleep(0.2)
-                        out = ser.read_until(expected = b'\r\n', size = 128)
-
-                    while out.decode('utf-8').find('+') > 0:
-                        # acks are turned on, so read again until acks are flushed
-                        out = ser.read_until(expected = b'\r\n', size = 128)
-                    
-                    # Close the port
-                    ser.close()
+                    name = port.strip() if port.strip().lower().startswith("qt:") else entry.name
+                    description = identify_port(name,
+                                                self.port_params.baud,
+                                                self.port_params.data_bits,
+                                                self.port_params.stop_bits,
+                                                self.port_params.timeout,
+                                                self.port_params.write_timeout,
+                                                self.clock)
                     
                     # Check the returned string for a valid description of an OC
-                    if out.decode('utf-8').find('OC') > 0:
+                    if description is not None:
                         
-                        self.OC_selected = entry.name
-                        self.OC_description.append(out.decode('utf-8'))
+                        self.OC_selected = name
+                        self.OC_description.append(description)
                     
                         # This port is good, so setup in the OC object and open
                         self.setup_port()
@@ -159,14 +271,14 @@ class OC:
         
                       
     def setup_port(self):
+        if self.OC_selected == "sim":
+            return # The simulator stands in for the port, see __init__()
         
-        self.OC = serial.Serial()
-        self.OC.baudrate = self.port_params.baud
-        self.OC.port = self.OC_selected
-        self.OC.bytesize = self.port_params.data_bits
-        self.OC.stopbits = self.port_params.stop_bits
-        self.OC.timeout = self.port_params.timeout
-        self.OC.write_timeout = self.port_params.write_timeout
+        self.OC = make_transport(self.OC_selected, self.port_params, self.clock)
+        if isinstance(self.OC, QtSerialTransport):
+            # Qt says when bytes arrive, so pushed status is parsed there and then rather
+            # than when the GUI next reads it
+            self.OC.data_listeners.append(self.data_arrived)
 
 
         
@@ -174,6 +286,10 @@ class OC:
 
         self.OC.open()
 
+        # Nothing is known about the state of the OC on a new connection
+        self.shadow.clear()
+        self.unacked.clear()
+
         success = self.get_status()
         
         return success
@@ -183,120 +299,296 @@ class OC:
 
 ############## Simple setters and getters
 
-    def set_continuous_output(self):
-        cmd = bytes(b'!nxx1;1;\r') # Set continuous update to oven 1 at 1Hz
-        success = self.send_command(cmd)
-        return success   
+    # The setters skip the write if the OC has already confirmed that setting (see 
+    # update_shadow()). Pass force=True to send it regardless. disable() is always sent, 
+    # so a stale shadow can never stop the output being turned off.
+
+    def set_continuous_output(self, force=False, rate=None, channel=None):
+        # Have the OC push its status rate times a second [Hz] for channel (oven). Left as
+        # None they are the ones last set, 1 Hz for oven 1 to begin with. Returns False
+        # without sending anything for a rate the OC or the link can not sustain, or for a
+        # channel other than 1.
+        rate = self.push_rate if rate is None else rate
+        channel = self.push_channel if channel is None else channel
+        if not self.check_push_rate(rate) or not self.check_push_channel(channel):
+            return False
+        self.push_rate, self.push_channel = rate, channel
+        cmd = self.continuous_command(rate, channel)
+        starting = self.starts_push(cmd, force)
+        success = self.send_setting(cmd, force)
+        if success and starting:
+            self.push_stats = PushStats(rate, self.clock)
+        return success
+
+    def starts_push(self, cmd, force=False):
+        # True if sending cmd (re)starts continuous output, rather than stopping it or being
+        # skipped as already set
+        if not cmd.startswith(b'!nxx') or cmd.startswith(b'!nxx0;'):
+            return False
+        return force or not self.already_set(cmd)
 
-    def stop_continuous_output(self):
-        cmd = bytes(b'!nxx0;1;\r') # Stop continuous update to oven 1
-        success = self.send_command(cmd)
+    def stop_continuous_output(self, force=False):
+        cmd = self.continuous_command(0, self.push_channel) # Stop continuous update
+        success = self.send_setting(cmd, force)
         return success
+
+    def continuous_command(self, rate, channel):
+        return bytes(b'!nxx%d;%d;\r' % (rate, channel))
+
+    def check_push_rate(self, rate):
+        # True if the OC can push at rate [Hz] over this link
+        link_rate = link_push_rate(self.port_params.baud)
+        if rate != int(rate) or rate < 1:
+            print("Error: The push rate must be a whole number of Hz, not", rate)
+            return False
+        if rate > MAX_PUSH_RATE:
+            print("Error: The OC pushes its status at up to %d Hz, not %s" % (MAX_PUSH_RATE, rate))
+            return False
+        if rate > link_rate:
+            print("Error: %d baud only leaves room for %d status messages a second" % (self.port_params.baud, link_rate))
+            return False
+        return True
     
-    def enable(self):
+    def check_push_channel(self, channel):
+        # True for channel 1. Pushed messages are taken as the status of oven 1, as that is
+        # the one status requests ask for, so another oven's would corrupt it and the shadow.
+        if channel != 1:
+            print("Error: Only channel 1 can be pushed, not", channel)
+            return False
+        return True
+
+    def enable(self, force=False):
         # Enables output of the OC to heat the oven. 
         cmd = bytes(b'!mxx1;1;\r')
-        success = self.send_command(cmd)
+        success = self.send_setting(cmd, force)
         return success
 
-    def disable(self):
-        # Enables output of the OC to heat the oven.
+    def disable(self, force=True):
+        # Disables output of the OC to heat the oven.
         cmd = bytes(b'!mxx0;1;\r')
-        success = self.send_command(cmd)
+        success = self.send_setting(cmd, force)
         return success
 
-    def set_temperature(self, temp):
+    def set_temperature(self, temp, force=False):
         self.requested_temperature = temp
-        str = "!ixx1;%3.3f;100;0;%3.3f;1;0;\r" % (self.requested_temperature, self.ramp_rate)
-        cmd = bytes(str, 'utf-8')
-        success = self.send_command(cmd)
+        self.cancel_queued('setpoint') # Sent now, so anything queued is out of date
+        cmd = self.setpoint_command()
+        success = self.send_setting(cmd, force)
         return success
+
+    def queue_temperature(self, temp):
+        # As set_temperature(), but sent by flush_commands() once the OC can take a write
+        self.requested_temperature = temp
+        self.queue_command('setpoint', self.setpoint_command())
     
-    def get_temperature(self): 
-        self.get_status()
+    def get_temperature(self, max_age=None): 
+        self.get_status(self.status_max_age if max_age is None else max_age)
         return self.temperature[0]
         
-    def set_ramp_rate(self, rate):
-        # Set the ramp rate, coercing to within 0.01 and 100 C/s
+    def set_ramp_rate(self, rate, force=False):
+        self.ramp_rate = self.limit_ramp_rate(rate)
+        self.cancel_queued('setpoint') # Sent now, so anything queued is out of date
+        
+        cmd = self.setpoint_command()
+        success = self.send_setting(cmd, force)
+        return success
+
+    def queue_ramp_rate(self, rate):
+        # As set_ramp_rate(), but sent by flush_commands() once the OC can take a write
+        self.ramp_rate = self.limit_ramp_rate(rate)
+        self.queue_command('setpoint', self.setpoint_command())
+
+    def limit_ramp_rate(self, rate):
+        # Coerce the ramp rate to within 0.01 and 100 C/s
         if rate < 0.01:
             rate = 0.01
             print("Requested rate too low. Value set to 0.01 C/s")
         if rate > 100:
             rate = 100
             print("Requested rate too high. Value set to 100 C/s")
-        
-        self.ramp_rate = rate
-        
-        str = "!ixx1;%3.3f;100;0;%3.3f;1;0;\r" % (self.requested_temperature, rate)
-        cmd = bytes(str, 'utf-8')
-        success = self.send_command(cmd)
-        return success
+        return rate
+
+    def setpoint_command(self):
+        # The setpoint and the ramp rate are always sent together, in one command. Until a
+        # temperature has been requested, the setpoint last reported by the OC is used.
+        temp = self.setpoint[0] if self.requested_temperature == [] else self.requested_temperature
+        str = "!ixx1;%3.3f;100;0;%3.3f;1;0;\r" % (temp, self.ramp_rate)
+        return bytes(str, 'utf-8')
     
     def get_ramp_rate(self): 
         
         return self.ramp_rate[0]
     
-    def get_faults(self):
-        self.get_status()
+    def get_faults(self, max_age=None):
+        self.get_status(self.status_max_age if max_age is None else max_age)
         return self.fault_code[0]
         
+    def status_age(self):
+        # Seconds since the last status message was parsed, or None if there has not been one
+        if self.status_time is None:
+            return None
+        return self.clock.monotonic() - self.status_time
         
-    def get_status(self):
+    def get_status(self, max_age=0):
+        # A status parsed within the last max_age seconds is reused rather than 
+        # asking the device again. max_age = 0 always queries the device.
+        age = self.status_age()
+        if age is not None and max_age > 0 and age <= max_age:
+            return True
+
+        # Only one request is sent at a time. Callers that were waiting on the lock while
+        # another caller refreshed the status share that result instead of sending their own.
+        t_request = self.clock.monotonic()
+        with self.status_lock:
+            if self.status_time is not None and self.status_time > t_request:
+                return True
+            return self.request_status()
+
+    def read_pushed_status(self):
+        # Parse anything the OC has sent without being asked, e.g. in continuous output
+        # mode, without blocking. Returns True if at least one status message was parsed.
+        received = False
+        self.read_available_bytes()
+        while self.message_available:
+            self.read_message()
+            if len(self.message) > 0 and self.parse_message() and self.msg_type == "status":
+                received = True
+                self.push_stats.record(self.status_time)
+        if received:
+            self.push_stats.backlog = max(self.push_stats.backlog, self.bytes_available())
+        return received
+
+    def data_arrived(self, transport):
+        # Called from Qt's event loop as bytes arrive on a QtSerialTransport. Errors are
+        # left for the next read outside it to find, e.g. a SupervisedOC's.
+        try:
+            self.read_pushed_status()
+        except OSError as e:
+            print("Error reading", self.OC_selected, e)
+
+    def read_or_poll(self, poll, push_timeout=PUSH_TIMEOUT):
+        # Read the status pushed in continuous output mode or, if none has arrived for
+        # push_timeout seconds, call poll() to ask for it, e.g. an AdaptivePoller's tick()
+        # so it is only asked as often as the oven needs. Returns True if a new status was
+        # read. Meant to be called often, e.g. from a GUI's timer.
+        return self.read_pushed_status() or (self.push_overdue(push_timeout) and bool(poll()))
+
+    def push_overdue(self, push_timeout=PUSH_TIMEOUT):
+        # True if no status has been parsed for push_timeout seconds
+        age = self.status_age()
+        return age is None or age >= push_timeout
+
+    def request_status(self):
         cmd = bytes(b'!jxx;1;\r') # Request status of oven 1
-        success = self.send_command(cmd)
+        success = self.send_command(cmd, PRIORITY_POLL)
         
                 # clear the message type for now
         self.msg_type = ""
-        t_start = datetime.now()
+        t_start = self.clock.now()
         timeout = 3
         if success:
             while not self.msg_type == "status":
                 
-                # read back response
+                # read back response, giving up if the OC has stopped answering
                 while not self.message_available:
                     self.read_available_bytes()
+                    if self.message_available:
+                        break
+                    if (self.clock.now() - t_start).total_seconds() > timeout:
+                        return False
+                    self.clock.sleep(0.001) # Give the reply time to arrive rather than spinning
 
                 self.read_message()
-                self.parse_message()
+                if len(self.message) > 0:
+                    self.parse_message()
 
-                dt = (datetime.now() - t_start)
-                if dt.seconds > timeout:
+                dt = (self.clock.now() - t_start)
+                if dt.total_seconds() > timeout:
                     success = False
                     return success
 
         return success
 
+    def configure(self, temperature=None, ramp_rate=None, enabled=None, continuous=None, force=False):
+        # Change several settings at once with as few writes as possible. Settings left as
+        # None are not changed. The setpoint and ramp rate share one command, so changing
+        # both costs one write, and at most three writes are needed for everything.
+        # Output is disabled before anything else is sent and only enabled once the new 
+        # setpoint is in place. Commands the OC has already confirmed are skipped unless
+        # force is True. Stops at the first failed write and returns False.
+        commands = []
+        if enabled is False:
+            commands.append(b'!mxx0;1;\r') # Always sent, as disable()
+        if temperature is not None or ramp_rate is not None:
+            if temperature is not None:
+                self.requested_temperature = temperature
+            if ramp_rate is not None:
+                self.ramp_rate = self.limit_ramp_rate(ramp_rate)
+            self.cancel_queued('setpoint') # Sent now, so anything queued is out of date
+            commands.append(self.setpoint_command())
+        if enabled is True:
+            commands.append(b'!mxx1;1;\r')
+        if continuous is not None:
+            commands.append(self.continuous_command(self.push_rate if continuous else 0, self.push_channel))
+
+        for cmd in commands:
+            starting = self.starts_push(cmd, force)
+            if not self.send_setting(cmd, force or cmd == b'!mxx0;1;\r'):
+                return False
+            if starting:
+                self.push_stats = PushStats(self.push_rate, self.clock)
+        return True
+
     def reset_defaults(self):
-        # Disable the output
-        self.disable()
-           
-        # Stop continuous output
-        self.stop_continuous_output()
-        
-        # Set ramp rate to 100 degrees C/s
-        self.set_ramp_rate(100)
-        
-        # Set the temperature to 40 C        
-        self.set_temperature(40)
+        # Disable the output, stop continuous output, and set the ramp rate to 100 degrees C/s
+        # and the temperature to 40 C
+        return self.configure(temperature=40, ramp_rate=100, enabled=False, continuous=False)
         
         
 ########## Utility functions
 
 
 
-    def send_command(self, cmd):
+    def send_command(self, cmd, priority=PRIORITY_SETTING):
         # Send the message to the OC. In case of error during the write, the 
         # method will make three attempts, if needed.
+        #
+        # The OC requires at least 200 ms between writes. To ensure this always happens
+        # callers wait here until the last write is far enough back. If several threads are
+        # waiting, the one with the most urgent priority (then the one that came first)
+        # writes next, so e.g. a disable() from one thread goes ahead of status polls and
+        # setpoint changes from others.
+        # A write still waiting when a safety command overrides it is dropped, see send_safety().
+        ticket = (priority, next(self.sequence))
+        with self.write_turn:
+            heapq.heappush(self.writers, ticket)
+            self.waiting[ticket] = cmd
+            try:
+                while ticket not in self.cancelled and (self.writers[0] != ticket or self.write_wait() > 0):
+                    self.clock.wait(self.write_turn, self.write_wait() if self.writers[0] == ticket else None)
+                if ticket in self.cancelled:
+                    return False
+                return self.write_command(cmd, priority)
+            finally:
+                self.writers.remove(ticket)
+                heapq.heapify(self.writers)
+                del self.waiting[ticket]
+                self.cancelled.discard(ticket)
+                self.write_turn.notify_all()
+
+    def write_command(self, cmd, priority):
         trying = 0
         while (trying < 4):
             try:
+                self.clock.sleep(self.write_wait())
+
                 bytes_written = self.OC.write(cmd)
-         
-                # The OC requires at least 200 ms between writes. To ensure this always happens
-                # a pause is added here
-                sleep(0.3)
+                if priority == PRIORITY_SAFETY:
+                    self.OC.flush() # Wait for it to leave the port, not just the buffer
+                self.last_write_time = self.clock.monotonic()
                 
                 if bytes_written == len(cmd):
+                    self.unacked.append(cmd)
                     trying = 100 # exit the loop as we do not need to try again
                     return True
 
@@ -308,8 +600,117 @@ class OC:
                     print("Error writing to the serial port\n")
                     print(e) # print the exception
 
+            trying += 1
+
         return False
 
+    def queue_command(self, key, cmd, priority=PRIORITY_SETTING):
+        # Queue a command to be sent by flush_commands(). Only the latest command for each key
+        # is kept, so a slider dragged through many values sends just the value it is at when
+        # the OC can next take a write, rather than a backlog of every value on the way.
+        # A replaced command keeps its place in the queue unless its priority changes.
+        if key in self.pending and self.pending[key][0] == priority:
+            sequence = self.pending[key][1]
+        else:
+            sequence = next(self.sequence)
+            heapq.heappush(self.pending_order, (priority, sequence, key))
+        self.pending[key] = (priority, sequence, cmd)
+
+    def cancel_queued(self, key):
+        # Drop the queued command for key, if there is one. Its entry in pending_order is 
+        # skipped when it comes up.
+        self.pending.pop(key, None)
+
+    def next_queued(self):
+        # Remove and return the most urgent queued command, or None if there are none
+        while self.pending_order:
+            priority, sequence, key = heapq.heappop(self.pending_order)
+            if self.pending.get(key, (None, None))[:2] == (priority, sequence):
+                return self.pending.pop(key)[2]
+        return None
+
+    def flush_commands(self):
+        # Send the most urgent queued command (the oldest of those with equal priority) if the
+        # write interval has passed. Never pauses, so it can be called from a GUI timer.
+        # Queued commands the OC has already confirmed are dropped without using up the
+        # write. Returns False if a write failed.
+        while self.pending and self.ready_to_write():
+            cmd = self.next_queued()
+            if not self.already_set(cmd):
+                return self.send_command(cmd)
+        return True
+
+    def send_setting(self, cmd, force=False):
+        # Send a command that changes a setting, unless the OC already has that setting
+        if not force and self.already_set(cmd):
+            return True
+        if cmd in safety_commands or cmd.startswith(b'!nxx0;'): # Stopping continuous output on any channel
+            return self.send_safety(cmd)
+        return self.send_command(cmd)
+
+    def send_safety(self, cmd):
+        # Send a safety command ahead of any other writes waiting for the OC. Queued commands
+        # it overrides, e.g. a queued enable for a disable, are cancelled first so they can
+        # not undo it, and so are writes other threads are waiting to send: they return
+        # False without writing. The time from here to the command leaving the port is kept
+        # in safety_latency. At worst it is one write_interval plus the time to write it.
+        t_call = self.clock.monotonic()
+        effect = self.command_effect(cmd)
+        for key, (priority, sequence, queued) in list(self.pending.items()):
+            if effect.keys() & self.command_effect(queued).keys():
+                self.cancel_queued(key)
+        with self.write_turn:
+            for ticket, waiting in self.waiting.items():
+                waiting_effect = self.command_effect(waiting)
+                if any(waiting_effect[key] != effect[key] for key in effect.keys() & waiting_effect.keys()):
+                    self.cancelled.add(ticket)
+            self.write_turn.notify_all()
+
+        success = self.send_command(cmd, PRIORITY_SAFETY)
+        if success:
+            latency = self.clock.monotonic() - t_call
+            self.safety_latency = (latency, max(latency, self.safety_latency[1]))
+        return success
+
+    def command_effect(self, cmd):
+        # The settings a command changes, as shadow entries
+        fields = cmd[4:].split(b';')
+        match cmd[1:2]:
+            case b'i':
+                return {'setpoint': round(float(fields[1]), 3), 'ramp_rate': round(float(fields[4]), 3)}
+            case b'm':
+                return {'enabled': fields[0] == b'1'}
+            case b'n':
+                return {'continuous': (int(fields[0]), int(fields[1]))} # (rate, channel), rate 0 is off
+            case other:
+                return {}
+
+    def already_set(self, cmd):
+        effect = self.command_effect(cmd)
+        if any(key in self.command_effect(sent) for sent in self.unacked for key in effect):
+            return False # A command still waiting for its ack changes it, so the shadow is out of date
+        return len(effect) > 0 and all(self.shadow.get(k) == v for k, v in effect.items())
+
+    def update_shadow(self, changes):
+        # The shadow holds the settings the OC has confirmed, either by acknowledging the
+        # command that set them or by reporting them in a status message. It is what the
+        # setters compare against to skip redundant writes, and a cheap way for a UI to read
+        # the state of the OC without asking it.
+        self.shadow.update(changes)
+
+    def shadow_state(self):
+        return dict(self.shadow)
+
+    def write_wait(self):
+        # Seconds until the OC can accept another write
+        if self.last_write_time is None:
+            return 0
+        return max(0, self.write_interval - (self.clock.monotonic() - self.last_write_time))
+
+    def ready_to_write(self):
+        # True if a command can be sent now without send_command() having to pause
+        return self.write_wait() == 0
+
     def bytes_available(self):
         # This is, possibly, redunant, but gives a place to add additional code for checking
         bytes_available = self.OC.in_waiting
@@ -324,6 +725,7 @@ class OC:
                 
             if bytes_available >= len(self.local_buffer):
                 # clear out the old and read in part of the new
+                self.push_stats.overruns += 1
                 self.local_buffer[:] = self.OC.read(len(self.local_buffer))
                 self.buff_end = len(self.local_buffer)
                 
@@ -357,7 +759,7 @@ class OC:
         n_crlf = self.local_buffer.find(b'\r\n')
         if n_crlf > 0:
             self.message_available = True
-            self.message_time =  datetime.now()  
+            self.message_time =  self.clock.now()  
             # if found, say raise Message_available
         else:
             self.message_available = False
@@ -391,19 +793,25 @@ class OC:
 
     def parse_message(self):
         
-        # Determine the message type
-        type_code = self.message.decode('utf-8')[0]
+        # Determine the message type. A frame garbled by line noise is dropped.
+        try:
+            type_code = self.message.decode('utf-8')[0]
+        except (UnicodeDecodeError, IndexError):
+            self.msg_type = ""
+            return False
 
         match type_code:
 
             case '+':
                 self.msg_type = "ack"   # replace all these strings with codes? put ascii back with a getter for when requested?
                 matched = True
+                # Acks come back in the order the commands were sent
+                if self.unacked:
+                    self.update_shadow(self.command_effect(self.unacked.popleft()))
 
             case 'j':
-                self.msg_type = "status"
-                self.parse_status_message()
-                matched = True
+                matched = self.parse_status_message()
+                self.msg_type = "status" if matched else ""
 
             case other:
                 self.msg_type = ""
@@ -422,23 +830,38 @@ class OC:
         
         parts = message.split(self.delimiter)
 
+        # Drop a status cut short or garbled, leaving the last good one in place
+        try:
+            setpoint, temperature, enabled, fault = float(parts[0][3:]), float(parts[1]), float(parts[2]), int(parts[5])
+        except (IndexError, ValueError):
+            return False
+
         # Check if OC is enabled
         if parts[2] == b'0':
             self.enable_state = False
         elif parts[2] == b'1':
             self.enable_state = True
         
+        self.status_time = self.clock.monotonic()
+
         # Get setpoint
-        self.setpoint = (float(parts[0][3:]), self.message_time)
+        self.setpoint = (setpoint, self.message_time)
         # Get actual temperature
-        self.temperature = (float(parts[1]), self.message_time)
+        self.temperature = (temperature, self.message_time)
         # Get state
-        self.enable_state = float(parts[2])
+        self.enable_state = enabled
+        
+        self.update_shadow({'setpoint': round(self.setpoint[0], 3), 
+                            'enabled': self.enable_state == 1})
         
         # Check fault status
-        self.fault_code = (float(parts[5]), self.message_time)
-        if int(parts[5]) != 0:
-            self.parse_fault(int(parts[5]))
+        self.fault_code = (float(fault), self.message_time)
+        if fault != 0:
+            self.parse_fault(fault)
+
+        for listener in self.status_listeners:
+            listener(self)
+        return True
         
     def parse_fault(self,fault):
         # Append any faults present to the fault queue
@@ -453,13 +876,3 @@ class OC:
             self.fault_queue.append("Temp fault present at " + self.message_time.strftime("%b %d %Y %H:%M:%S"))
         if fault & 0b00001:
             self.fault_queue.append("Inhibited fault present at " + self.message_time.strftime("%b %d %Y %H:%M:%S"))
-                
-                
-        
-if __name__ == '__main__':
-    app = QtWidgets.QApplication(sys.argv)
-    w = MainWindow()
-    app.exec()
-
-
-
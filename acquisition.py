@@ -0,0 +1,281 @@
+import multiprocessing
+import queue
+import threading
+import time
+from datetime import datetime
+from time import sleep
+
+import numpy as np
+
+import LDPD
+import OC
+from polling import AdaptivePoller
+from shared_ring import SharedRing
+
+# One record per LD-PD sample, laid out as LDPD.fields
+ldpd_record = np.dtype([(name, '<f8') for name in LDPD.fields])
+
+# One record per OC status message. time is the wall clock time it was parsed [s since
+# the epoch].
+oc_fields = ['time', 'temperature', 'setpoint', 'enabled', 'fault']
+oc_record = np.dtype([(name, '<f8') for name in oc_fields])
+
+
+def serve_commands(device, commands, replies):
+    # Carry out the commands the GUI has sent to an acquisition process, as (method name,
+    # args) tuples, replying to each with the method's result
+    try:
+        while True:
+            method, args = commands.get_nowait()
+            try:
+                result = getattr(device, method)(*args)
+            except Exception as e:
+                result = False
+                print("Error in", method, e)
+            replies.put((method, result))
+    except queue.Empty:
+        pass
+
+
+def acquire_ldpd(port, ring_name, commands, replies, stop):
+    # Body of the LD-PD acquisition process. Streams the LD-PD module on port into the
+    # shared ring and carries out the commands sent by the GUI.
+    ring = SharedRing(ldpd_record, name=ring_name)
+    ldpd = LDPD.LDPD(port)
+    if ldpd.LDPD_selected == "" or not ldpd.start_stream():
+        replies.put(("open", False))
+        ring.close()
+        return
+    ring.set_rate(ldpd.rate)
+    replies.put(("open", True))
+
+    try:
+        while not stop.is_set():
+            received = ldpd.read_samples()
+            if received > 0:
+                ring.write({name: ldpd.samples.last(name, received) for name in LDPD.fields})
+
+            serve_commands(ldpd, commands, replies)
+            ring.set_rate(ldpd.rate) # Changed by start_stream
+
+            if received == 0:
+                sleep(0.002)
+    finally:
+        ldpd.LDPD_close()
+        ring.close()
+
+
+def acquire_oc(port, ring_name, commands, replies, stop):
+    # Body of the OC acquisition process. Reads the continuous output of the OC on port,
+    # falling back to polling as the GUIs do, writes each status into the shared ring and
+    # carries out the commands sent by the GUI.
+    ring = SharedRing(oc_record, name=ring_name)
+    oc = OC.OC(port)
+    if oc.OC_selected == "" or not oc.set_continuous_output():
+        replies.put(("open", False))
+        ring.close()
+        return
+    replies.put(("open", True))
+    poller = AdaptivePoller()
+    poller.add("oc", oc)
+
+    try:
+        while not stop.is_set():
+            oc.flush_commands()
+            received = oc.read_or_poll(poller.tick)
+            if received:
+                ring.write({'time': [time.time()],
+                            'temperature': [oc.temperature[0]],
+                            'setpoint': [oc.setpoint[0]],
+                            'enabled': [oc.enable_state],
+                            'fault': [oc.fault_code[0]]})
+
+            serve_commands(oc, commands, replies)
+
+            if not received:
+                sleep(0.01)
+    finally:
+        oc.stop_continuous_output()
+        oc.OC_close()
+        ring.close()
+
+
+class RingSamples:
+    # Reads the shared ring for the GUI, looking like the LDPD's SampleBuffer
+
+    def __init__(self, ring):
+        self.ring = ring
+
+    def __len__(self):
+        return min(self.ring.count(), self.ring.capacity)
+
+    @property
+    def count(self):
+        return self.ring.count()
+
+    def latest(self, name):
+        count = self.ring.count()
+        if count == 0:
+            return None
+        return self.ring.records[name][(count - 1) % self.ring.capacity]
+
+    def last(self, name, n=None):
+        # The last n samples of a field, oldest first. A view onto the shared memory unless
+        # they wrap round the end of the ring.
+        count = self.ring.count()
+        n = len(self) if n is None else min(n, len(self))
+        (first, second), count, lost = self.ring.read(count - n)
+        if len(second) == 0:
+            return first[name]
+        return np.concatenate((first[name], second[name]))
+
+
+class AcquisitionProcess:
+    # Runs a device in a separate process, so nothing the GUI does (rendering in
+    # particular) can hold up reading its port. target(port, ring name, commands, replies,
+    # stop) is the body of the process: it writes records into a SharedRing and carries
+    # out the commands sent by call() through a queue. Each call waits for its result, one
+    # at a time, as e.g. a sweep worker may be sending commands alongside the GUI.
+    # Subclasses stand in for the device, forwarding only the methods the GUI uses.
+
+    def __init__(self, target, name, port, record, capacity, timeout):
+        self.timeout = timeout
+        self.ring = SharedRing(record, capacity, create=True)
+        context = multiprocessing.get_context('spawn') # No copy of the GUI's state in the child
+        self.commands = context.Queue()
+        self.replies = context.Queue()
+        self.stop = context.Event()
+        self.call_lock = threading.Lock()
+        self.process = context.Process(target=target, name=name, daemon=True,
+                                       args=(port, self.ring.name, self.commands, self.replies, self.stop))
+        self.process.start()
+        self.read_count = 0 # ring count at the last read_new()
+        self.frames_lost = 0 # Records overwritten in the ring before they were read
+        try:
+            self.opened = self.replies.get(timeout=self.timeout)[1]
+        except queue.Empty:
+            self.opened = False
+        if not self.opened:
+            self.close()
+
+    def read_new(self):
+        # Number of records written by the acquisition process since the last call
+        (first, second), count, lost = self.ring.read(self.read_count)
+        self.frames_lost += lost
+        received = count - self.read_count - lost
+        self.read_count = count
+        return received
+
+    def call(self, method, *args):
+        with self.call_lock:
+            if not self.process.is_alive():
+                return False
+            self.commands.put((method, args))
+            try:
+                while True:
+                    name, result = self.replies.get(timeout=self.timeout)
+                    if name == method:
+                        return result
+            except queue.Empty:
+                return False
+
+    def close(self):
+        self.stop.set()
+        self.process.join(self.timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+class AcquisitionLDPD(AcquisitionProcess):
+    # Stands in for an LDPD in the GUI while the module itself is run by acquire_ldpd().
+    # Samples come through the ring, read in place by samples.
+
+    def __init__(self, port, capacity=1 << 18, timeout=5):
+        super().__init__(acquire_ldpd, "LD-PD acquisition", port, ldpd_record, capacity, timeout)
+        self.samples = RingSamples(self.ring)
+        self.LDPD_selected = port if self.opened else ""
+
+    @property
+    def rate(self):
+        return self.ring.rate() if self.ring is not None else 0
+
+    def read_samples(self):
+        return self.read_new()
+
+    def latest(self):
+        if self.samples.count == 0:
+            return None
+        return {name: float(self.samples.latest(name)) for name in LDPD.fields}
+
+    def start_stream(self, rate=None):
+        return self.call("start_stream", rate)
+
+    def stop_stream(self):
+        return self.call("stop_stream")
+
+    def set_temperature(self, temp):
+        return self.call("set_temperature", temp)
+
+    def set_tec_mode(self, fast):
+        return self.call("set_tec_mode", fast)
+
+    def set_point_rate(self, rate):
+        return self.call("set_point_rate", rate)
+
+    def set_modulation(self, frequency, amplitude):
+        return self.call("set_modulation", frequency, amplitude)
+
+    def send_command(self, cmd):
+        return self.call("send_command", cmd)
+
+    def halt_current(self):
+        return self.call("halt_current")
+
+    def LDPD_close(self):
+        self.close()
+
+
+class AcquisitionOC(AcquisitionProcess):
+    # Stands in for an OC in the GUI while acquire_oc() runs it, in continuous output mode
+    # with polling to fall back on. read_status() takes in what has arrived through the
+    # ring, leaving the latest status in temperature, setpoint, enable_state and
+    # fault_code as the OC would. Identifying the OC takes a few seconds, hence the
+    # longer timeout.
+
+    def __init__(self, port, capacity=4096, timeout=10):
+        super().__init__(acquire_oc, "OC acquisition", port, oc_record, capacity, timeout)
+        self.OC_selected = port if self.opened else ""
+        self.temperature = (0, "")
+        self.setpoint = (0, "")
+        self.enable_state = []
+        self.fault_code = (0, "")
+
+    def read_status(self):
+        # True if a status has arrived since the last call
+        if self.ring is None or self.read_new() == 0:
+            return False
+        latest = self.ring.records[(self.read_count - 1) % self.ring.capacity]
+        message_time = datetime.fromtimestamp(latest['time'])
+        self.temperature = (float(latest['temperature']), message_time)
+        self.setpoint = (float(latest['setpoint']), message_time)
+        self.enable_state = float(latest['enabled'])
+        self.fault_code = (float(latest['fault']), message_time)
+        return True
+
+    def enable(self, force=False):
+        return self.call("enable", force)
+
+    def disable(self, force=True):
+        return self.call("disable", force)
+
+    def set_temperature(self, temp, force=False):
+        return self.call("set_temperature", temp, force)
+
+    def set_ramp_rate(self, rate, force=False):
+        return self.call("set_ramp_rate", rate, force)
+
+    def OC_close(self):
+        self.close()
@@ -0,0 +1,63 @@
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class SystemClock:
+    # The real time. The OC driver and its simulator take their time from a clock object
+    # like this one, so they can be given a VirtualClock instead.
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def now(self):
+        return datetime.now()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def wait(self, condition, timeout=None):
+        # Wait on a threading.Condition, which must be held, for up to timeout seconds
+        return condition.wait(timeout)
+
+
+class VirtualClock:
+    # Time that only moves when something sleeps or advance() is called, and then moves
+    # instantly. A whole session with a simulated OC, write pacing and timeouts included,
+    # runs as fast as the code does, and every interval in it is exact.
+    #
+    # Meant for a single thread. wait() can not be woken by another thread, so it just
+    # lets the time run out.
+
+    def __init__(self, start=0.0, wall_start=None):
+        self.time = start # [s]
+        self.start = start
+        self.wall_start = datetime(2000, 1, 1) if wall_start is None else wall_start
+        self.lock = threading.Lock()
+
+    def monotonic(self):
+        return self.time
+
+    def now(self):
+        return self.wall_start + timedelta(seconds=self.time - self.start)
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.advance(seconds)
+
+    def wait(self, condition, timeout=None):
+        if timeout is None:
+            raise RuntimeError("Waiting forever on a virtual clock")
+        self.sleep(timeout)
+        return False
+
+    def advance(self, seconds):
+        # Always moves the time on, even by less than it can resolve, so a loop sleeping
+        # for what is left of an interval can not get stuck on rounding
+        with self.lock:
+            self.time = max(self.time + seconds, math.nextafter(self.time, math.inf))
+
+
+system_clock = SystemClock()
@@ -0,0 +1,18 @@
+# Framing shared by the serial devices in the lab (the OC temperature controller and the
+# LD-PD laser module).
+#
+# Commands are ASCII: '!', a one letter code, 'xx', then the fields, each followed by ';',
+# and a carriage return, e.g. b'!ixx1;40.000;100;0;100.000;1;0;\r'.
+# Everything the devices send back is framed by SOH at the start and CRLF at the end, with
+# a one letter message type straight after the SOH, e.g. b'\x01+\r\n' for an ack.
+
+SOH = b'\x01'
+EOL = b'\r\n'
+ACK = b'+'
+IDENTIFY = b'!?;\r' # Asks the device to describe itself, e.g. the reply b'\x01OC2 v1.0\r\n'
+
+
+def make_command(code, *fields):
+    # make_command('s', '25.000') -> b'!sxx25.000;\r'
+    return b'!' + code.encode('ascii') + b'xx' + b''.join(str(f).encode('ascii') + b';' for f in fields) + b'\r'
+
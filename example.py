@@ -19,8 +19,9 @@ Additionally, the example scripts use both numpy (https://numpy.org/) and matplo
 '''
 
 import OC
+from stability import StabilityDetector
+from ramp import RampRateEstimator
 import numpy as np
-from datetime import datetime, timedelta
 from time import sleep
 from matplotlib import pyplot as plt
 
@@ -40,6 +41,9 @@ oc = OC.OC(com_port)
 # Reading of the state of the OC is done here through a direct call
 # to the get_status() method. This requests the status of the 
 # controller and heater and places the returned values 
+# in the OC object. Each status is passed to a StabilityDetector, which
+# keeps track of how far the temperature has strayed from the setpoint 
+# over the stability time and reports when it has settled.
 
 # Define stability criteria
 target_temperature = 60 # units: C
@@ -53,8 +57,7 @@ success = oc.set_temperature(target_temperature)
 oc.enable()
 
 # Monitor temperature and test for stability
-in_range = False
-time_in_range = timedelta()
+detector = StabilityDetector(tolerance = stability_range, hold_time = stability_time)
 stable = False
 
 
@@ -74,24 +77,8 @@ while not stable:
 
     print("Setpoint: ", str(oc.setpoint[0]), "C.  Current temperature: ", str(oc.temperature[0]))
     
-    temp_diff = abs(oc.temperature[0]-oc.setpoint[0])
-    
-    if temp_diff <= stability_range:
-        if not in_range:
-            in_range = True
-            restart = True
-        
-        if in_range and restart:
-            t0 = datetime.now()
-            restart = False
-        else:
-            time_in_range = datetime.now() - t0
-            
-            if time_in_range.seconds >= stability_time:
-                stable = True
-    else:
-        in_range = False
-        time_in_range = timedelta()
+    if detector.update_oc(oc) == "stable":
+        stable = True
     
     # Pause for a bit
     sleep(1)    
@@ -124,6 +111,10 @@ del oc
 # was received. 
 # Operating in this way reduces the time spent communicating with the device, freeing
 # the resource for other aspects of your program.
+#
+# The achieved ramp rate is measured while the ramp is running by a RampRateEstimator,
+# which fits the last 30 s of temperatures as each status arrives. If the oven is 
+# falling well behind the requested rate, a warning is printed straight away.
 
 # Make an OC object
 oc = OC.OC(com_port)
@@ -136,15 +127,16 @@ ramp_rate = 0.1 # Rate of change of temperature. Units C/s
 monitored_temps = []
 monitored_times = []
 
+# Make the ramp rate estimator
+estimator = RampRateEstimator(expected_rate = ramp_rate, window = 30, setpoint = ramp_end)
+
 # Make file to log temperatures to
 fname = "OC log.csv"
 fid = open(fname, mode = "w") # open the file
 fid.write("Time, Elasped time [s], Temperature [C] \n") # write the header
 
-# Set the setpoint and ramp rate of the OC
-oc.set_temperature(ramp_end)
-
-oc.set_ramp_rate(ramp_rate)
+# Set the setpoint and ramp rate of the OC. configure() sends both in a single command
+oc.configure(temperature = ramp_end, ramp_rate = ramp_rate)
 
 # Enable continuous output
 oc.set_continuous_output()
@@ -156,13 +148,8 @@ oc.enable()
 while oc.temperature[0] < oc.requested_temperature:
     
     # Check for bytes received from the OC. These are parsed to look for complete messages
-    # and then, if a message is available, the message_available property is set to true 
-    oc.read_available_bytes()
-    
-    # Check for new messages
-    if oc.message_available:
-        oc.read_message()
-        oc.parse_message()
+    # and any status messages found update the OC object. 
+    if oc.read_pushed_status():
         
         print(oc.message.decode('utf-8'))
         
@@ -174,6 +161,13 @@ while oc.temperature[0] < oc.requested_temperature:
         dt = oc.temperature[1] - monitored_times[0]
         csv_str = str(oc.temperature[1]) + ", " + str(dt.total_seconds()) + ", " + str(oc.temperature[0]) + "\n"
         fid.write(csv_str)
+
+        # Update the live ramp rate measurement
+        rate = estimator.update(dt.total_seconds(), oc.temperature[0])
+        if rate is not None:
+            print("Ramp rate: %3.3f C/s (requested %3.3f C/s)" % (rate, ramp_rate))
+        if estimator.too_slow():
+            print("Warning: the oven is ramping %3.3f C/s slower than requested" % -estimator.deviation())
         
     # Do other things here, read other sensors etc.... 
     sleep(0.1)
@@ -184,10 +178,10 @@ fid.close()
 # Return to the defaults
 oc.reset_defaults()
 
-# Plot the temperature data and measure the ramping rate
+# Plot the temperature data and the ramp rate fitted over the end of the ramp
 elapsed_seconds = np.ndarray((len(monitored_times)))
 for ii, t in enumerate(monitored_times):
-    elapsed_seconds[ii] = (monitored_times[ii]-monitored_times[0]).seconds
+    elapsed_seconds[ii] = (monitored_times[ii]-monitored_times[0]).total_seconds()
 
 f1, ax1 = plt.subplots()
 ax1.plot(elapsed_seconds, monitored_temps,
@@ -197,7 +191,8 @@ ax1.plot(elapsed_seconds, monitored_temps,
          markerfacecolor = 'none',
          linestyle = 'none',
          label = "Temperature Ramp")
-lin_fit_m, lin_fit_b = np.polyfit(elapsed_seconds, monitored_temps, deg=1)
+fit_t, fit_temp, lin_fit_m = estimator.line()
+lin_fit_b = fit_temp - lin_fit_m * fit_t
 
 ax1.axline( xy1 = (0,lin_fit_b), slope = lin_fit_m, 
            color = 'r',
@@ -0,0 +1,41 @@
+from time import perf_counter
+
+from PyQt5.QtCore import QEvent, QObject, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QGroupBox
+
+
+class FirstFrame(QObject):
+    # Watches a window for its first paint and emits shown with the time taken to get there
+    # [s], measured from t_start (e.g. perf_counter() at the top of the script). The signal is
+    # emitted from the event loop just after the paint, so slots connected to it run once the
+    # user can already see the window.
+    shown = pyqtSignal(float)
+
+    def __init__(self, window, t_start):
+        super().__init__(window)
+        self.t_start = t_start
+        self.elapsed = None
+        window.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint and self.elapsed is None:
+            self.elapsed = perf_counter() - self.t_start
+            obj.removeEventFilter(self)
+            QTimer.singleShot(0, lambda: self.shown.emit(self.elapsed))
+        return False
+
+
+class LazyPanel(QGroupBox):
+    # A group box that takes its place in the layout straight away but only builds its
+    # contents when build_contents() is first called. build is a function returning the
+    # layout for the box.
+
+    def __init__(self, title, build):
+        super().__init__(title)
+        self.build = build
+
+    def build_contents(self, *args):
+        if self.build is None:
+            return
+        build, self.build = self.build, None
+        self.setLayout(build())
@@ -0,0 +1,140 @@
+import numpy as np
+from time import monotonic
+
+from device_protocal import SOH, EOL, ACK
+from LDPD import frame_dtype, DATA, frame_eol
+
+
+class LDPDSimulator:
+    # Stands in for the serial port of a laser module, so the LD-PD GUI and the LDPD driver
+    # can be run without the hardware: LDPD("sim") uses one.
+    #
+    # It answers commands the way the module does and, while streaming, produces frames
+    # at the requested rate, limited to what the baud rate could carry. The LD temperature
+    # follows the setpoint with a first order lag (faster with the TEC in fast mode), the
+    # TEC drive is proportional to the temperature error, and the PD current follows the LD
+    # current above threshold, falling as the laser warms up. The waveform table is played
+    # at the point rate and its last point held. All readings have a little noise on them.
+
+    def __init__(self, baud=115200, seed=None):
+        self.baud = baud
+        self.is_open = False
+        self.rx = bytearray() # Bytes waiting to be read
+        self.rate = 0
+        self.seq = 0
+        self.t_sent = None # monotonic time up to which frames have been produced
+        self.case_temp = 24.0 # [C]
+        self.ld_temp = 25.0 # [C]
+        self.setpoint = 25.0 # [C]
+        self.tec_fast = True
+        self.point_rate = 100 # [points/s]
+        self.table = np.zeros(1) # LD current points still to play, the first one playing [mA]
+        self.t_play = 0.0 # monotonic time the first point of table started playing
+        self.threshold = 20.0 # LD threshold current [mA]
+        self.rng = np.random.default_rng(seed)
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+        self.rate = 0
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.rx.clear()
+
+    def write(self, cmd):
+        self.produce()
+        code, fields = cmd[1:2], cmd[4:].rstrip(b'\r').split(b';')[:-1]
+        match code:
+            case b'?':
+                self.reply(b'LD-PD simulator v1.0')
+                return len(cmd)
+            case b'd':
+                self.rate = int(fields[0])
+                self.t_sent = monotonic()
+            case b's':
+                self.setpoint = float(fields[0])
+            case b't':
+                self.tec_fast = fields[0] == b'1'
+            case b'r':
+                self.point_rate = int(fields[0])
+            case b'w':
+                points = np.array([int(f) for f in fields]) / 1000
+                if self.playing(monotonic()) >= len(self.table):
+                    self.table, self.t_play = points, monotonic() # Was holding the last point
+                else:
+                    self.table = np.concatenate((self.table, points))
+            case b'h':
+                self.table, self.t_play = np.zeros(1), monotonic()
+        self.reply(ACK)
+        return len(cmd)
+
+    def reply(self, text):
+        self.rx += SOH + text + EOL
+
+    @property
+    def in_waiting(self):
+        self.produce()
+        return len(self.rx)
+
+    def read(self, size=1):
+        self.produce()
+        out = bytes(self.rx[:size])
+        del self.rx[:size]
+        return out
+
+    def readinto(self, buffer):
+        out = self.read(len(buffer))
+        buffer[:len(out)] = out
+        return len(out)
+
+    def read_until(self, expected=EOL, size=None):
+        self.produce()
+        end = self.rx.find(expected)
+        end = len(self.rx) if end < 0 else end + len(expected)
+        return self.read(end)
+
+    def playing(self, t):
+        # Index in table of the point playing at time t
+        return np.floor((t - self.t_play) * self.point_rate).astype(int)
+
+    def produce(self):
+        # Add the frames due since the last call
+        if self.rate <= 0:
+            return
+        now = monotonic()
+        rate = min(self.rate, self.baud / 10 / frame_dtype.itemsize)
+        n = int((now - self.t_sent) * rate)
+        if n <= 0:
+            return
+        self.t_sent += n / rate
+
+        # The LD temperature after each of the n sample periods
+        tau = 0.5 if self.tec_fast else 3.0 # [s]
+        decay = np.exp(-np.arange(1, n + 1) / (rate * tau))
+        ld = self.setpoint + (self.ld_temp - self.setpoint) * decay
+        self.ld_temp = ld[-1]
+
+        # The LD current at each sample, then drop the points that have been played
+        times = self.t_sent - (n - 1 - np.arange(n)) / rate
+        index = np.clip(self.playing(times), 0, len(self.table) - 1)
+        current = self.table[index]
+        self.table = self.table[index[-1]:]
+        self.t_play += index[-1] / self.point_rate
+
+        frames = np.zeros(n, frame_dtype)
+        frames['soh'] = SOH[0]
+        frames['kind'] = DATA[0]
+        frames['seq'] = (self.seq + np.arange(n)) % 65536
+        frames['case'] = np.round((self.case_temp + self.rng.normal(0, 0.02, n)) * 100)
+        frames['ld'] = np.round((ld + self.rng.normal(0, 0.005, n)) * 100)
+        light = 0.02 * np.maximum(current - self.threshold, 0) * (1 - 0.01 * (ld - 25))
+        frames['pd'] = np.round((light + self.rng.normal(0, 0.002, n)) * 1e6)
+        frames['tec'] = np.round(np.clip((self.setpoint - ld) * 200, -1000, 1000))
+        frames['eol'] = frame_eol
+        self.seq = (self.seq + n) % 65536
+        self.rx += frames.tobytes()
@@ -0,0 +1,94 @@
+import numpy as np
+from collections import namedtuple
+
+# Demodulated output. x and y are the in phase and quadrature parts, r the amplitude and
+# theta the phase [degrees], one value per output sample.
+LockInOutput = namedtuple('LockInOutput', ['x', 'y', 'r', 'theta'])
+
+
+def rc_filter(z, a, state):
+    # First order low pass, y[n] = a y[n-1] + (1 - a) z[n], over a whole block at once.
+    # Unrolled, y[n] = a^(n+1) y[-1] + (1 - a) a^n sum(z[k] / a^k), so it is a cumulative sum
+    # scaled by powers of a. The block is taken in pieces short enough that a^-k stays
+    # well inside the range of a float. Returns the filtered block and the new state.
+    out = np.empty_like(z)
+    piece = max(1, int(-100 / np.log10(a))) if a > 0 else 1
+    for start in range(0, len(z), piece):
+        chunk = z[start:start + piece]
+        powers = a ** np.arange(len(chunk))
+        out[start:start + len(chunk)] = (a * state * powers
+                                         + (1 - a) * powers * np.cumsum(chunk / powers))
+        state = out[start + len(chunk) - 1]
+    return out, state
+
+
+class LockIn:
+    # Software lock-in amplifier for the PD signal. Blocks of samples are passed to
+    # process() as they are streamed in and every stage works on the whole block:
+    #
+    #  1. Mixing with the reference at harmonic x frequency (1 for 1f, 2 for 2f), shifted
+    #     by phase [degrees]. The reference carries on from one block to the next.
+    #  2. A FIR boxcar average of decimation samples, which also decimates. Samples left
+    #     over at the end of a block are kept for the next one.
+    #  3. order first order IIR low pass stages with time constant [s], at the decimated
+    #     rate.
+    #
+    # Outputs are multiplied by gain, as the Gain setting of the demodulator panel. With
+    # the default decimation the output rate is about ten samples per time constant.
+
+    def __init__(self, sample_rate, frequency, harmonic=1, phase=0, time_constant=0.01,
+                 order=2, decimation=None, gain=1):
+        if harmonic * frequency >= sample_rate / 2:
+            raise ValueError("%g Hz reference is above the Nyquist frequency of %g Hz samples"
+                             % (harmonic * frequency, sample_rate))
+        self.sample_rate = sample_rate # [Hz]
+        self.frequency = frequency # Modulation frequency [Hz]
+        self.harmonic = harmonic
+        self.phase = phase # [degrees]
+        self.time_constant = time_constant # [s]
+        self.order = order
+        if decimation is None:
+            decimation = max(1, int(sample_rate * time_constant / 10))
+        self.decimation = decimation
+        self.gain = gain
+        self.reset()
+
+    def reset(self):
+        self.cycle = 0.0 # Reference phase at the start of the next block [cycles]
+        self.leftover = np.zeros(0, complex) # Mixed samples not yet averaged
+        self.state = np.zeros(self.order, complex) # Output of each IIR stage
+        self.latest = None # Last output, as a LockInOutput of floats
+
+    def output_rate(self):
+        return self.sample_rate / self.decimation
+
+    def process(self, samples):
+        # Demodulate a block of samples. Returns the new output samples, which may be none
+        # if the block was shorter than the decimation.
+        samples = np.asarray(samples, dtype=float)
+        n = len(samples)
+
+        # Mixing, as one complex multiply: 2 x exp(-i (w t + phase)), low passed, is X + iY
+        step = self.harmonic * self.frequency / self.sample_rate # [cycles per sample]
+        angle = 2 * np.pi * (self.cycle + step * np.arange(n)) + np.radians(self.phase)
+        mixed = 2 * samples * np.exp(-1j * angle)
+        self.cycle = (self.cycle + step * n) % 1
+
+        # Boxcar average and decimate
+        if len(self.leftover) > 0:
+            mixed = np.concatenate((self.leftover, mixed))
+        whole = len(mixed) // self.decimation * self.decimation
+        self.leftover = mixed[whole:]
+        z = mixed[:whole].reshape(-1, self.decimation).mean(axis=1)
+
+        # Low pass
+        if len(z) > 0:
+            a = np.exp(-1 / (self.time_constant * self.output_rate()))
+            for i in range(self.order):
+                z, self.state[i] = rc_filter(z, a, self.state[i])
+
+        z = z * self.gain
+        output = LockInOutput(z.real, z.imag, np.abs(z), np.degrees(np.angle(z)))
+        if len(z) > 0:
+            self.latest = LockInOutput(*(float(v[-1]) for v in output))
+        return output
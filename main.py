@@ -1,7 +1,10 @@
+from time import perf_counter
+t_start = perf_counter() # For reporting the time taken to show the window
+
 import sys, os
 
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QIcon
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtGui import QFont
@@ -27,15 +30,28 @@ from PyQt5.QtWidgets import (
     QSystemTrayIcon,
     QLCDNumber)
  
+# All the images, compiled from resources.qrc. Rebuild after changing any of them with:
+#   pyrcc5 resources.qrc -o resources_rc.py
+import resources_rc
+from gui_startup import FirstFrame, LazyPanel
+from port_monitor import PortMonitor
+import LDPD
+from lockin import LockIn
+from sweep import SweepRunner, slope_sweep, dc_sweep
+from acquisition import AcquisitionLDPD
+
 basedir = os.path.dirname(__file__)
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, acquisition_process=False):
         super().__init__()
+        # With acquisition_process the LD-PD module is read by a separate process, so 
+        # drawing the window can never delay the samples
+        self.acquisition_process = acquisition_process
 
         self.setWindowTitle("IITD EQUIP LAB")
         self.setGeometry(100, 100, 1000, 600)
-        self.setWindowIcon(QIcon("iitdelhilogo.jpg"))
+        self.setWindowIcon(QIcon(":/icons/iitdelhilogo.jpg"))
 
         
 
@@ -56,37 +72,141 @@ class MainWindow(QMainWindow):
         content_layout = QHBoxLayout()
         main_layout.addLayout(content_layout)
 
+        # The waveform and demodulator panels are filled in once the window is on screen
+        waveform = LazyPanel("Waveform", self.waveform_panel)
+        demodulator = LazyPanel("Demodulator", self.demodulator_panel)
+
         content_layout.addWidget(self.temperature_panel(), 1)
-        content_layout.addWidget(self.waveform_panel(), 3)
-        content_layout.addWidget(self.demodulator_panel(), 1)
+        content_layout.addWidget(waveform, 3)
+        content_layout.addWidget(demodulator, 1)
 
         main_layout.addLayout(self.bottom_controls())
 
+        # The laser module, once connected. Its samples are read and displayed by a timer.
+        self.ldpd = None
+        self.lockin = None # Demodulates the PD current, once set up from the demodulator panel
+        self.sweep = None # SweepRunner of the current sweep
+        self.read_timer = QTimer(self)
+        self.read_timer.setInterval(50)
+        self.read_timer.timeout.connect(self.update_readings)
+
+        self.first_frame = FirstFrame(self, t_start)
+        self.first_frame.shown.connect(waveform.build_contents)
+        self.first_frame.shown.connect(demodulator.build_contents)
+        self.first_frame.shown.connect(self.report_startup)
+
  # ---------------- Instrument Bar ----------------
     def instrument_bar(self):
         layout = QHBoxLayout()
 
         btn_refresh = QPushButton("Refresh")
-        btn_refresh.setIcon(QIcon("arrow.png"))
+        btn_refresh.setIcon(QIcon(":/icons/arrow.png"))
+        btn_refresh.clicked.connect(self.refresh_ports)
         layout.addWidget(btn_refresh)
 
         #layout.addWidget(QPushButton("Refresh"))
 
         
         #self.port_box.setIcon(QIcon("password.png"))
+        # The port list is kept up to date by a background monitor
         self.port_box = QComboBox()
-        self.port_box.addItems(["COM1", "COM2", "COM3", "COM4"])
+        self.port_box.addItem("Simulator", "sim")
+        self.port_monitor = PortMonitor(parent=self)
+        self.port_monitor.port_added.connect(self.add_port)
+        self.port_monitor.port_removed.connect(self.remove_port)
+        self.port_monitor.start()
         layout.addWidget(self.port_box)
 
 
-        btn_connect = QPushButton("Connect")
-        btn_connect.setIcon(QIcon("plug.png"))
-        layout.addWidget(btn_connect)
+        self.btn_connect = QPushButton("Connect")
+        self.btn_connect.setIcon(QIcon(":/icons/plug.png"))
+        self.btn_connect.clicked.connect(self.toggle_connection)
+        layout.addWidget(self.btn_connect)
         layout.addStretch()
-        layout.addWidget(QLabel("Disconnected"))
+        self.connection_label = QLabel("Disconnected")
+        layout.addWidget(self.connection_label)
 
         return layout
 
+    def refresh_ports(self):
+        self.port_monitor.rescan()
+
+    def add_port(self, name):
+        if self.port_box.findText(name) < 0:
+            self.port_box.addItem(name)
+
+    def remove_port(self, name):
+        index = self.port_box.findText(name)
+        if index >= 0:
+            self.port_box.removeItem(index)
+
+    def toggle_connection(self):
+        if self.ldpd is not None:
+            self.disconnect_ldpd()
+            return
+
+        port = self.port_box.currentData() or self.port_box.currentText()
+        try:
+            if self.acquisition_process:
+                ldpd = AcquisitionLDPD(port)
+            else:
+                ldpd = LDPD.LDPD(port)
+        except Exception as e:
+            self.connection_label.setText("Error: %s" % e)
+            return
+        if ldpd.LDPD_selected == "" or not ldpd.start_stream():
+            ldpd.LDPD_close() # Frees the port, or the acquisition process and its ring
+            self.connection_label.setText("No LD-PD module on %s" % self.port_box.currentText())
+            return
+
+        self.ldpd = ldpd
+        self.ldpd.set_tec_mode(self.tec_fast.isChecked())
+        self.read_timer.start()
+        self.btn_connect.setText("Disconnect")
+        self.connection_label.setText("Connected, %d samples/s" % self.ldpd.rate)
+
+    def disconnect_ldpd(self):
+        self.read_timer.stop()
+        if self.sweep is not None:
+            self.sweep.stop()
+            self.sweep = None
+        self.lockin = None
+        try:
+            self.ldpd.LDPD_close()
+        except Exception:
+            pass
+        self.ldpd = None
+        self.btn_connect.setText("Connect")
+        self.connection_label.setText("Disconnected")
+
+    def update_readings(self):
+        # Only the newest sample is shown. The rest stay in self.ldpd.samples for plotting.
+        try:
+            received = self.ldpd.read_samples()
+        except Exception as e:
+            self.disconnect_ldpd()
+            self.connection_label.setText("Error: %s" % e)
+            return
+        latest = self.ldpd.latest()
+        if latest is not None:
+            self.case_temp.display("%.2f" % latest['case'])
+            self.ld_temp.display("%.2f" % latest['ld'])
+            self.pd_current.display("%.3f" % latest['pd'])
+
+        if self.sweep is not None:
+            self.show_sweep_progress()
+
+        if self.lockin is not None and received > 0:
+            self.lockin.process(self.ldpd.samples.last('pd', received))
+            if self.lockin.latest is not None:
+                self.demod_indicator.setText("%.4g\n%.1f°" % (self.lockin.latest.r, self.lockin.latest.theta))
+
+    def closeEvent(self, event):
+        self.port_monitor.stop()
+        if self.ldpd is not None:
+            self.disconnect_ldpd()
+        event.accept()
+
     # ---------------- Temperature Panel ----------------
     def temperature_panel(self):
         box = QGroupBox("Temperature")
@@ -114,6 +234,7 @@ class MainWindow(QMainWindow):
         self.tec_fast = QRadioButton("Fast")
         self.tec_slow = QRadioButton("Slow")
         self.tec_fast.setChecked(True)
+        self.tec_fast.toggled.connect(self.set_tec_mode)
 
         layout.addWidget(self.tec_fast, 3, 1)
         layout.addWidget(self.tec_slow, 4, 1)
@@ -124,93 +245,187 @@ class MainWindow(QMainWindow):
         self.temp_set.setSuffix(" °C")
 
         layout.addWidget(self.temp_set, 5, 1)
-        layout.addWidget(QPushButton("Set Temperature"), 6, 1)
+        btn_set_temp = QPushButton("Set Temperature")
+        btn_set_temp.clicked.connect(self.set_ld_temperature)
+        layout.addWidget(btn_set_temp, 6, 1)
 
         box.setLayout(layout)
         return box
 
+    def set_ld_temperature(self):
+        if self.ldpd is not None:
+            self.ldpd.set_temperature(self.temp_set.value())
+
+    def set_tec_mode(self, fast):
+        if self.ldpd is not None:
+            self.ldpd.set_tec_mode(fast)
+
     # ---------------- Waveform Panel ----------------
     def waveform_panel(self):
-        box = QGroupBox("Waveform")
         layout = QGridLayout()
 
         layout.addWidget(QLabel("Start (mA)"), 0, 0)
-        layout.addWidget(QSlider(Qt.Horizontal), 0, 1)
+        self.sweep_start = QSlider(Qt.Horizontal)
+        self.sweep_start.setRange(0, 200)
+        layout.addWidget(self.sweep_start, 0, 1)
 
         layout.addWidget(QLabel("End (mA)"), 1, 0)
-        layout.addWidget(QSlider(Qt.Horizontal), 1, 1)
+        self.sweep_end = QSlider(Qt.Horizontal)
+        self.sweep_end.setRange(0, 200)
+        self.sweep_end.setValue(100)
+        layout.addWidget(self.sweep_end, 1, 1)
 
         layout.addWidget(QLabel("Slope"), 2, 0)
-        layout.addWidget(QSlider(Qt.Horizontal), 2, 1)
+        self.sweep_slope = QSlider(Qt.Horizontal) # [mA/s]
+        self.sweep_slope.setRange(1, 100)
+        self.sweep_slope.setValue(10)
+        layout.addWidget(self.sweep_slope, 2, 1)
 
         layout.addWidget(QLabel("Sinewave Frequency"), 3, 0)
-        freq = QSpinBox()
-        freq.setRange(1, 100000)
-        freq.setValue(35000)
-        freq.setSuffix(" Hz")
-        layout.addWidget(freq, 3, 1)
+        self.sine_freq = QSpinBox()
+        self.sine_freq.setRange(1, 100000)
+        self.sine_freq.setValue(35000)
+        self.sine_freq.setSuffix(" Hz")
+        layout.addWidget(self.sine_freq, 3, 1)
 
         layout.addWidget(QLabel("Amplitude (p-p)"), 4, 0)
-        layout.addWidget(QSlider(Qt.Horizontal), 4, 1)
+        self.sine_amplitude = QSlider(Qt.Horizontal) # [0.1 mA]
+        self.sine_amplitude.setRange(0, 100)
+        layout.addWidget(self.sine_amplitude, 4, 1)
 
-        layout.addWidget(QPushButton("Set Parameters"), 5, 1)
+        for slider in (self.sweep_start, self.sweep_end, self.sweep_slope, self.sine_amplitude):
+            slider.valueChanged.connect(self.show_sweep_settings)
 
-        box.setLayout(layout)
-        return box
+        btn_set = QPushButton("Set Parameters")
+        btn_set.clicked.connect(self.set_modulation)
+        layout.addWidget(btn_set, 5, 1)
+
+        return layout
 
     # ---------------- Demodulator Panel ----------------
     def demodulator_panel(self):
-        box = QGroupBox("Demodulator")
         layout = QGridLayout()
 
         layout.addWidget(QLabel("Output"), 0, 0)
-        out = QComboBox()
-        out.addItems(["1f", "2f"])
-        layout.addWidget(out, 0, 1)
+        self.demod_output = QComboBox()
+        self.demod_output.addItems(["1f", "2f"])
+        layout.addWidget(self.demod_output, 0, 1)
 
         layout.addWidget(QLabel("Gain"), 1, 0)
-        gain = QComboBox()
-        gain.addItems(["1X", "10X", "100X"])
-        layout.addWidget(gain, 1, 1)
+        self.demod_gain = QComboBox()
+        self.demod_gain.addItems(["1X", "10X", "100X"])
+        layout.addWidget(self.demod_gain, 1, 1)
 
         layout.addWidget(QLabel("2f Phase"), 2, 0)
-        phase = QSpinBox()
-        phase.setRange(0, 360)
-        phase.setSuffix("°")
-        layout.addWidget(phase, 2, 1)
+        self.demod_phase = QSpinBox()
+        self.demod_phase.setRange(0, 360)
+        self.demod_phase.setSuffix("°")
+        layout.addWidget(self.demod_phase, 2, 1)
 
-        indicator = QLabel("◯")
-        indicator.setAlignment(Qt.AlignCenter)
-        indicator.setStyleSheet("font-size: 60px;")
-        layout.addWidget(indicator, 3, 0, 1, 2)
+        self.demod_indicator = QLabel("◯")
+        self.demod_indicator.setAlignment(Qt.AlignCenter)
+        self.demod_indicator.setStyleSheet("font-size: 60px;")
+        layout.addWidget(self.demod_indicator, 3, 0, 1, 2)
 
-        layout.addWidget(QPushButton("Set"), 4, 0, 1, 2)
+        btn_set = QPushButton("Set")
+        btn_set.clicked.connect(self.set_demodulator)
+        layout.addWidget(btn_set, 4, 0, 1, 2)
 
-        box.setLayout(layout)
-        return box
+        return layout
+
+    def set_demodulator(self):
+        # Demodulate the streamed PD current at the waveform's sine frequency. The stream
+        # has to be fast enough for the chosen harmonic.
+        if self.ldpd is None or self.ldpd.rate == 0:
+            self.statusBar().showMessage("Connect to the LD-PD module first", 5000)
+            return
+        harmonic = 2 if self.demod_output.currentText() == "2f" else 1
+        try:
+            self.lockin = LockIn(self.ldpd.rate, self.sine_freq.value(), harmonic,
+                                 phase=self.demod_phase.value() if harmonic == 2 else 0,
+                                 time_constant=0.1,
+                                 gain=int(self.demod_gain.currentText().rstrip("X")))
+        except ValueError as e:
+            self.lockin = None
+            self.statusBar().showMessage(str(e), 5000)
+            return
+        self.demod_indicator.setStyleSheet("font-size: 20px;")
+
+    # ---------------- Startup time ----------------
+    def report_startup(self, elapsed):
+        self.statusBar().showMessage("Started in %.0f ms" % (elapsed * 1000), 10000)
+        print("Time to first frame: %.0f ms" % (elapsed * 1000))
 
     # ---------------- Bottom Controls ----------------
     def bottom_controls(self):
         layout = QHBoxLayout()
-        layout.addWidget(QPushButton("Run: Slope"))
-        layout.addWidget(QPushButton("Run: DC"))
+        btn_slope = QPushButton("Run: Slope")
+        btn_slope.clicked.connect(self.run_slope)
+        layout.addWidget(btn_slope)
+        btn_dc = QPushButton("Run: DC")
+        btn_dc.clicked.connect(self.run_dc)
+        layout.addWidget(btn_dc)
         btn_stop = QPushButton("Stop")
-        btn_stop.setIcon(QIcon("stop.png"))
+        btn_stop.setIcon(QIcon(":/icons/stop.png"))
+        btn_stop.clicked.connect(self.stop_sweep)
         layout.addWidget(btn_stop)
         layout.addStretch()
         btn_save = QPushButton("Save All Settings")
-        btn_save.setIcon(QIcon("save.png"))
+        btn_save.setIcon(QIcon(":/icons/save.png"))
         layout.addWidget(btn_save)
         return layout
 
-
-
+    # ---------------- Sweeps ----------------
+    def show_sweep_settings(self, *args):
+        self.statusBar().showMessage("Start %d mA, end %d mA, slope %d mA/s, amplitude %.1f mA p-p"
+                                     % (self.sweep_start.value(), self.sweep_end.value(),
+                                        self.sweep_slope.value(), self.sine_amplitude.value() / 10), 3000)
+
+    def set_modulation(self):
+        if self.ldpd is not None:
+            self.ldpd.set_modulation(self.sine_freq.value(), self.sine_amplitude.value() / 10)
+
+    def run_slope(self):
+        self.run_sweep(slope_sweep(self.sweep_start.value(), self.sweep_end.value(),
+                                   self.sweep_slope.value(), frequency=self.sine_freq.value(),
+                                   amplitude=self.sine_amplitude.value() / 10))
+
+    def run_dc(self):
+        self.run_sweep(dc_sweep(self.sweep_start.value(), frequency=self.sine_freq.value(),
+                                amplitude=self.sine_amplitude.value() / 10))
+
+    def run_sweep(self, sweep):
+        # The whole waveform is worked out before it starts. A worker thread sends it to the
+        # module while update_readings() shows how far it has got.
+        if self.ldpd is None:
+            self.statusBar().showMessage("Connect to the LD-PD module first", 5000)
+            return
+        if self.sweep is not None:
+            self.sweep.stop()
+        self.sweep = SweepRunner(self.ldpd, sweep)
+        self.sweep.start()
+
+    def stop_sweep(self):
+        if self.sweep is not None:
+            self.sweep.stop()
+            self.sweep = None
+        elif self.ldpd is not None:
+            self.ldpd.halt_current()
+        self.statusBar().showMessage("Stopped", 3000)
+
+    def show_sweep_progress(self):
+        if self.sweep.running():
+            self.statusBar().showMessage("Sweep %.0f %%" % (100 * self.sweep.progress()))
+        else:
+            error = self.sweep.error
+            self.statusBar().showMessage("Sweep failed: %s" % error if error else "Sweep finished", 5000)
+            self.sweep = None
 
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
-    app.setWindowIcon(QIcon(os.path.join(basedir, "icons", "iitdelhilogo.ico")))
-    window = MainWindow()
+    app.setWindowIcon(QIcon(":/icons/iitdelhilogo.ico"))
+    window = MainWindow(acquisition_process="--acquisition-process" in sys.argv)
     window.show()
     sys.exit(app.exec_())  # Corrected to sys.exit
     app.exec() 
\ No newline at end of file
@@ -0,0 +1,138 @@
+'''
+Command line tool for running the same operation on many OC controllers at once, e.g.
+when commissioning a rack of ovens:
+
+python oc_cli.py status com3 com4 com5
+python oc_cli.py set com3 com4 com5 --temperature 60 --ramp 0.5
+python oc_cli.py enable --all
+python oc_cli.py reset --all --jobs 4
+python oc_cli.py rates com3 --rates 1 2 5 10 --duration 20
+
+Each port is handled by its own worker, up to --jobs at a time, so the whole run takes
+about as long as the slowest single device rather than the sum of them. The results are
+printed as a JSON list with one entry per port, in the order the ports were given.
+
+rates runs the continuous output at each rate in turn and reports how the status messages
+arrived (see OC.PushStats), with the highest rate that was sustained: none missed, no
+buffer overruns and never more than one message left waiting after a read.
+'''
+
+import argparse
+import contextlib
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+
+import serial.tools.list_ports
+
+import OC
+
+operations = ['status', 'set', 'enable', 'disable', 'reset', 'rates']
+
+
+def status(oc):
+    if not oc.get_status():
+        raise IOError("No status from the OC")
+    return {"temperature": oc.temperature[0],
+            "setpoint": oc.setpoint[0],
+            "enabled": bool(oc.enable_state),
+            "fault": int(oc.fault_code[0])}
+
+
+def measure_push_rate(oc, rate, duration):
+    # Read the continuous output at rate [Hz] for duration seconds, as fast as the OC
+    # parses it, and return how the messages arrived
+    if not oc.set_continuous_output(rate=rate):
+        raise IOError("Could not set continuous output at %s Hz" % rate)
+    oc.read_pushed_status() # Anything from before the change
+    oc.push_stats = OC.PushStats(rate, oc.clock)
+    t_end = monotonic() + duration
+    while monotonic() < t_end:
+        if not oc.read_pushed_status():
+            sleep(0.25 / rate)
+    return oc.push_stats.summary()
+
+
+def sustained(summary):
+    return summary["missed"] == 0 and summary["overruns"] == 0 and summary["backlog"] <= OC.STATUS_BYTES
+
+
+def run(port, args):
+    # Open one OC, carry out the operation and close it again. Errors are reported in the
+    # result rather than raised, so one bad port does not affect the others.
+    t_start = monotonic()
+    result = {"port": port, "ok": False}
+    oc = None
+    try:
+        oc = OC.OC(port)
+        if oc.OC_selected == "":
+            raise IOError("No OC controller found")
+
+        match args.operation:
+            case 'set':
+                success = oc.configure(temperature=args.temperature, ramp_rate=args.ramp)
+            case 'enable':
+                success = oc.enable()
+            case 'disable':
+                success = oc.disable()
+            case 'reset':
+                success = oc.reset_defaults()
+            case 'rates':
+                result["rates"] = []
+                try:
+                    for rate in args.rates:
+                        result["rates"].append(measure_push_rate(oc, rate, args.duration))
+                finally:
+                    oc.stop_continuous_output(force=True)
+                result["best"] = max([r["rate"] for r in result["rates"] if sustained(r)], default=None)
+                success = True
+            case other:
+                success = True
+        if not success:
+            raise IOError("Could not write to the OC")
+
+        result["status"] = status(oc)
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        if oc is not None and oc.OC.is_open:
+            oc.OC_close()
+    result["elapsed"] = round(monotonic() - t_start, 3)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an operation on many OC controllers in parallel")
+    parser.add_argument('operation', choices=operations)
+    parser.add_argument('ports', nargs='*', help="Serial ports of the OCs, e.g. com3 com4")
+    parser.add_argument('--temperature', '-t', type=float, help="Setpoint for the set operation [C]")
+    parser.add_argument('--ramp', type=float, help="Ramp rate for the set operation [C/s]")
+    parser.add_argument('--rates', type=int, nargs='+', default=list(range(1, OC.MAX_PUSH_RATE + 1)),
+                        help="Continuous output rates [Hz] to try for the rates operation")
+    parser.add_argument('--duration', type=float, default=10.0, help="Time [s] to run each rate for")
+    parser.add_argument('--all', action='store_true', help="Use every serial port on the computer")
+    parser.add_argument('--jobs', '-j', type=int, default=16, help="Most ports to talk to at once")
+    args = parser.parse_args(argv)
+
+    ports = list(args.ports)
+    if args.all:
+        ports += [p.name for p in serial.tools.list_ports.comports() if p.name not in ports]
+    if not ports:
+        parser.error("no ports given")
+    if args.operation == 'set' and args.temperature is None:
+        parser.error("set needs --temperature")
+
+    # The OC class prints its progress, which would get mixed up with the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+            results = list(pool.map(lambda port: run(port, args), ports))
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    return 0 if all(r["ok"] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
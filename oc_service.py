@@ -0,0 +1,387 @@
+'''
+Headless service that owns the serial connections to one or more OC controllers and
+shares them with any number of local clients (GUIs, logging scripts, ...) over a Unix
+socket, since a serial port can only be opened by one process at a time.
+
+Start it with the ports to serve:
+
+python oc_service.py com3 com4 --socket /tmp/oc_service.sock
+
+Each OC is put into continuous output mode and a reader thread parses its status
+messages as they arrive, so a status request is normally answered from the last pushed
+message without touching the device. Identical status requests that arrive together are
+served by a single device query, and every pushed status is copied to all clients
+subscribed to that port, so N clients cost one device stream. An OC that stops sending
+for --stale-after seconds is marked "stale" in its status, and subscribers are sent its
+status when it goes stale and when it recovers. --push-rate sets how many status messages
+an OC sends a second.
+
+With --poll the OCs are not put into continuous output mode. Instead one thread polls
+them all, each as often as what it is doing calls for (see polling.AdaptivePoller): fast
+while ramping or faulted, rarely once settled or disabled. This suits many OCs sharing a
+slow serial hub. A polled OC is only stale once it has gone --stale-after seconds past
+its longest interval, --max-interval, without answering.
+
+Protocol: the client sends one request per line, as space separated words, and gets one
+JSON object per line back. Every reply has "ok" and, if ok is false, "error".
+
+    ports                   -> {"ok": true, "ports": [...]}
+    status PORT [MAX_AGE]   -> {"ok": true, "status": {...}}
+    set PORT TEMPERATURE    -> {"ok": true}
+    ramp PORT RATE          -> {"ok": true}
+    enable PORT             -> {"ok": true}
+    disable PORT            -> {"ok": true}
+    subscribe PORT          -> {"ok": true}, then one {"status": {...}} per pushed message
+                               until the client disconnects
+    stats PORT              -> {"ok": true, "stats": {...}}, how the pushed messages are
+                               arriving (see OC.PushStats)
+'''
+
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+from time import sleep, monotonic
+
+import OC
+from polling import AdaptivePoller
+from staleness import StalenessWatchdog
+
+default_socket = os.path.join(os.environ.get('XDG_RUNTIME_DIR', '/tmp'), 'oc_service.sock')
+
+
+class ServedOC:
+    # One OC and the clients subscribed to it. io_lock is held for all traffic with the
+    # device, so the reader thread and client commands never interleave on the port.
+
+    def __init__(self, name, oc, max_age, continuous=True):
+        self.name = name
+        self.oc = oc
+        self.max_age = max_age # Oldest status [s] returned without querying the device
+        self.continuous = continuous # Read continuous output, rather than being polled
+        self.io_lock = threading.Lock()
+        self.subscribers = []
+        self.subscribers_lock = threading.Lock()
+        self.stale = False # Set by the service's watchdog when the OC stops reporting
+        self.running = True
+        self.reader = threading.Thread(target=self.read_loop, name="OC reader " + name, daemon=True)
+
+    def start(self):
+        if self.continuous:
+            with self.io_lock:
+                self.oc.set_continuous_output()
+            self.reader.start()
+
+    def stop(self):
+        self.running = False
+        if self.continuous:
+            self.reader.join()
+        with self.io_lock:
+            if self.continuous:
+                self.oc.stop_continuous_output()
+            self.oc.OC_close()
+
+    def poll(self):
+        # An error only fails this poll, so one bad device or frame can not stop the others
+        try:
+            with self.io_lock:
+                success = self.oc.get_status()
+        except OSError as e:
+            print("Error polling the OC on %s, reopening it: %s" % (self.name, e))
+            self.reopen()
+            return False
+        except Exception as e:
+            print("Error polling the OC on %s: %s" % (self.name, e))
+            return False
+        if success:
+            self.publish(self.snapshot())
+        return success
+
+    def read_loop(self):
+        # Runs for as long as the service does, so an error is reported and reading goes on
+        while self.running:
+            try:
+                with self.io_lock:
+                    received = self.oc.read_pushed_status()
+            except OSError as e:
+                print("Error reading the OC on %s, reopening it: %s" % (self.name, e))
+                if not self.reopen():
+                    sleep(1)
+                continue
+            except Exception as e:
+                print("Error reading the OC on %s: %s" % (self.name, e))
+                received = False
+            if received:
+                self.publish(self.snapshot())
+            else:
+                sleep(0.05)
+
+    def reopen(self):
+        # Close and reopen the port after an error from it, putting the OC back into
+        # continuous output if it was in it. Returns True if the OC answered.
+        with self.io_lock:
+            try:
+                self.oc.OC_close()
+            except OSError:
+                pass
+            try:
+                self.oc.setup_port()
+                success = self.oc.OC_open()
+                if success and self.continuous:
+                    success = self.oc.set_continuous_output(force=True)
+            except OSError as e:
+                print("Could not reopen the OC on %s: %s" % (self.name, e))
+                success = False
+        return success
+
+    def snapshot(self):
+        oc = self.oc
+        return {"port": self.name,
+                "time": oc.message_time.isoformat() if oc.status_time is not None else None,
+                "temperature": oc.temperature[0],
+                "setpoint": oc.setpoint[0],
+                "enabled": bool(oc.enable_state),
+                "fault": int(oc.fault_code[0]),
+                "stale": self.stale}
+
+    def status(self, max_age=None):
+        max_age = self.max_age if max_age is None else max_age
+        age = self.oc.status_age()
+        if age is None or age > max_age:
+            # Requests that queue up behind one already in flight share its result
+            t_request = monotonic()
+            with self.io_lock:
+                if self.oc.status_time is None or self.oc.status_time < t_request:
+                    if not self.oc.get_status(max_age):
+                        raise IOError("No status from the OC on " + self.name)
+        return self.snapshot()
+
+    def command(self, method, *args):
+        with self.io_lock:
+            if not method(*args):
+                raise IOError("Could not write to the OC on " + self.name)
+
+    def safety_command(self, method, *args):
+        # Safety commands do not wait for io_lock, which may be held for a whole status
+        # request. The OC orders concurrent writes itself and sends these first.
+        if not method(*args):
+            raise IOError("Could not write to the OC on " + self.name)
+
+    def subscribe(self):
+        # Each subscriber gets its own bounded queue. A client that stops reading loses its
+        # oldest samples rather than holding up the reader thread.
+        q = queue.Queue(maxsize=100)
+        with self.subscribers_lock:
+            self.subscribers.append(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self.subscribers_lock:
+            self.subscribers.remove(q)
+
+    def publish(self, sample):
+        with self.subscribers_lock:
+            subscribers = list(self.subscribers)
+        for q in subscribers:
+            while True:
+                try:
+                    q.put_nowait(sample)
+                    break
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+
+class OCService(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, ports, max_age=1.5, stale_after=3.0, poller=None, push_rate=1):
+        # poller is an AdaptivePoller to poll the OCs with, or None to use continuous output
+        self.socket_path = socket_path
+        self.devices = {}
+        self.poller = poller
+        # Continuous output arrives at 1 Hz or faster, so an OC is stale after missing a few
+        # messages. A settled OC that is polled is only heard from every max_interval.
+        timeout = stale_after if poller is None else poller.max_interval + stale_after
+        self.watchdog = StalenessWatchdog(timeout, on_event=self.stale_event)
+        self.watchdog_thread = threading.Thread(target=self.watch_loop, name="OC watchdog", daemon=True)
+        for port in ports:
+            oc = OC.OC(port)
+            if oc.OC_selected == "" or not oc.check_push_rate(push_rate):
+                print("Not serving", port.strip().upper())
+                continue
+            oc.push_rate = push_rate
+            self.devices[port.strip().lower()] = ServedOC(port.strip().lower(), oc, max_age, poller is None)
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, RequestHandler)
+
+        for device in self.devices.values():
+            self.watchdog.watch_oc(device.oc, device.name)
+            device.start()
+            if poller is not None:
+                poller.add(device.name, device.oc)
+        self.watchdog_thread.start()
+        if poller is not None:
+            threading.Thread(target=self.poll_loop, name="OC poller", daemon=True).start()
+
+    def poll_loop(self):
+        while True:
+            try:
+                self.poller.tick(poll=lambda name: self.devices[name].poll())
+            except Exception as e:
+                print("Error in the poller:", e)
+            due = self.poller.next_time()
+            sleep(0.1 if due is None else min(0.1, max(0, due - monotonic())))
+
+    def watch_loop(self):
+        while True:
+            self.watchdog.advance()
+            sleep(self.watchdog.resolution)
+
+    def stale_event(self, event):
+        device = self.devices[event.key]
+        device.stale = event.kind == "stale"
+        print("OC on %s %s, last heard from %.1f s ago" % (event.key, event.kind, event.age))
+        device.publish(device.snapshot())
+
+    def device(self, port):
+        try:
+            return self.devices[port.lower()]
+        except KeyError:
+            raise KeyError("Port not served: " + port)
+
+    def server_close(self):
+        super().server_close()
+        for device in self.devices.values():
+            device.stop()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            words = line.decode('utf-8').split()
+            if not words:
+                continue
+            try:
+                reply = self.dispatch(words)
+            except Exception as e:
+                reply = {"ok": False, "error": str(e)}
+            if not self.send(reply):
+                return
+            if reply.get("ok") and words[0] == "subscribe":
+                self.stream(self.server.device(words[1]))
+                return
+
+    def dispatch(self, words):
+        server = self.server
+        match words:
+            case ["ports"]:
+                return {"ok": True, "ports": sorted(server.devices)}
+            case ["status", port]:
+                return {"ok": True, "status": server.device(port).status()}
+            case ["status", port, max_age]:
+                return {"ok": True, "status": server.device(port).status(float(max_age))}
+            case ["set", port, temperature]:
+                device = server.device(port)
+                device.command(device.oc.set_temperature, float(temperature))
+            case ["ramp", port, rate]:
+                device = server.device(port)
+                device.command(device.oc.set_ramp_rate, float(rate))
+            case ["enable", port]:
+                device = server.device(port)
+                device.command(device.oc.enable)
+            case ["disable", port]:
+                device = server.device(port)
+                device.safety_command(device.oc.disable)
+            case ["subscribe", port]:
+                server.device(port)
+            case ["stats", port]:
+                return {"ok": True, "stats": server.device(port).oc.push_stats.summary()}
+            case other:
+                raise ValueError("Unknown request: " + " ".join(words))
+        return {"ok": True}
+
+    def stream(self, device):
+        q = device.subscribe()
+        try:
+            while self.send({"status": q.get()}):
+                pass
+        finally:
+            device.unsubscribe(q)
+
+    def send(self, reply):
+        try:
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+            return True
+        except OSError:
+            return False
+
+
+class OCClient:
+    # Minimal client for the service, e.g.
+    #
+    #   client = OCClient()
+    #   print(client.request("status com3"))
+    #   for sample in OCClient().subscribe("com3"): ...
+
+    def __init__(self, socket_path=default_socket):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.file = self.socket.makefile('rwb')
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def request(self, line):
+        self.file.write(line.encode('utf-8') + b'\n')
+        self.file.flush()
+        return json.loads(self.file.readline())
+
+    def subscribe(self, port):
+        reply = self.request("subscribe " + port)
+        if not reply["ok"]:
+            raise IOError(reply["error"])
+        for line in self.file:
+            yield json.loads(line)["status"]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve OC controllers to local clients")
+    parser.add_argument('ports', nargs='+', help="Serial ports of the OCs to serve, e.g. com3")
+    parser.add_argument('--socket', default=default_socket, help="Path of the Unix socket to listen on")
+    parser.add_argument('--max-age', type=float, default=1.5,
+                        help="Oldest status [s] returned to clients without querying the OC")
+    parser.add_argument('--stale-after', type=float, default=3.0,
+                        help="Time [s] without a message from an OC before it is reported stale, "
+                             "on top of --max-interval with --poll")
+    parser.add_argument('--push-rate', type=int, default=1,
+                        help="Status messages [Hz] each OC sends in continuous output mode")
+    parser.add_argument('--poll', action='store_true',
+                        help="Poll the OCs as often as each needs, rather than using continuous output")
+    parser.add_argument('--min-interval', type=float, default=0.5,
+                        help="With --poll, time [s] between polls of an OC that is ramping or faulted")
+    parser.add_argument('--max-interval', type=float, default=10.0,
+                        help="With --poll, longest time [s] between polls of an OC")
+    args = parser.parse_args()
+
+    poller = AdaptivePoller(args.min_interval, args.max_interval) if args.poll else None
+    service = OCService(args.socket, args.ports, args.max_age, args.stale_after, poller, args.push_rate)
+    print("Serving", ", ".join(sorted(service.devices)), "on", args.socket)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.server_close()
@@ -0,0 +1,212 @@
+import math
+import os
+import select
+import socket
+import threading
+from collections import deque
+
+from clock import system_clock
+
+SOH = b'\x01'
+EOL = b'\r\n'
+
+
+class OCSimulator:
+    # Stands in for the serial port of an OC, so the OC driver can be run without the
+    # hardware: OC("sim") uses one. Give it the same clock as the OC (a clock.VirtualClock
+    # for tests) and the whole session runs on that time.
+    #
+    # It acknowledges each command with '+', answers a status request with a status frame
+    # and, with continuous output on, sends a status frame at the push rate. Like the OC it
+    # ignores a write that comes less than 200 ms after the one before. The oven ramps
+    # towards the setpoint at the ramp rate while the output is enabled and otherwise cools
+    # towards ambient. The latest writes are kept in writes, with the time they arrived, so
+    # tests can check the pacing of the driver exactly. Set fault to inject a fault code,
+    # and responding to False to have it go silent.
+
+    def __init__(self, clock=system_clock, ambient=25.0, cooling=0.05):
+        self.clock = clock
+        self.is_open = False
+        self.rx = bytearray() # Bytes waiting to be read
+        self.writes = deque(maxlen=10000) # (clock time, command) of the latest writes
+        self.ignored = 0 # Writes that came too soon after the one before
+        self.min_write_interval = 0.2 # [s]
+        self.ambient = ambient # [C]
+        self.cooling = cooling # Rate the oven cools towards ambient when disabled [1/s]
+        self.temp = ambient # [C]
+        self.setpoint = ambient # [C]
+        self.ramp_rate = 100.0 # [C/s]
+        self.enabled = 0
+        self.fault = 0
+        self.continuous = False
+        self.push_rate = 1 # Continuous output rate [Hz]
+        self.responding = True # False to have it take writes but send nothing, as if unplugged
+        self.t_model = clock.monotonic() # clock time the temperature was worked out for
+        self.t_pushed = None # clock time of the last continuous status frame
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.rx.clear()
+
+    def write(self, cmd):
+        self.produce()
+        t = self.clock.monotonic()
+        if self.writes and t - self.writes[-1][0] < self.min_write_interval:
+            self.ignored += 1
+            self.writes.append((t, bytes(cmd)))
+            return len(cmd) # The port takes it, the OC never acts on it
+        self.writes.append((t, bytes(cmd)))
+
+        code, fields = cmd[1:2], cmd[4:].rstrip(b'\r').split(b';')[:-1]
+        match code:
+            case b'?':
+                self.reply(b'OC2 simulator v1.0')
+                return len(cmd)
+            case b'i':
+                self.setpoint = float(fields[1])
+                self.ramp_rate = float(fields[4])
+            case b'm':
+                self.enabled = int(cmd[4:5])
+            case b'n':
+                self.push_rate = int(fields[0])
+                self.continuous = self.push_rate > 0
+                self.t_pushed = t
+        self.reply(b'+')
+        if code == b'j':
+            self.reply(self.status_frame())
+        return len(cmd)
+
+    def reply(self, text):
+        if self.responding:
+            self.rx += SOH + text + EOL
+
+    def status_frame(self):
+        return b'jxx%.3f;%.3f;%d;0;0;%d' % (self.setpoint, self.temp, self.enabled, self.fault)
+
+    @property
+    def in_waiting(self):
+        self.produce()
+        return len(self.rx)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def read(self, size=1):
+        self.produce()
+        out = bytes(self.rx[:size])
+        del self.rx[:size]
+        return out
+
+    def readall(self):
+        return self.read(self.in_waiting)
+
+    def read_until(self, expected=EOL, size=None):
+        self.produce()
+        end = self.rx.find(expected)
+        end = len(self.rx) if end < 0 else end + len(expected)
+        return self.read(end if size is None else min(end, size))
+
+    def advance_model(self, t):
+        # Bring the oven temperature up to time t
+        dt = t - self.t_model
+        if dt <= 0:
+            return
+        self.t_model = t
+        if self.enabled:
+            step = self.ramp_rate * dt
+            self.temp += max(-step, min(step, self.setpoint - self.temp))
+        else:
+            self.temp = self.ambient + (self.temp - self.ambient) * math.exp(-self.cooling * dt)
+
+    def produce(self):
+        # Bring the model up to now and add the continuous status frames due since the last call
+        t = self.clock.monotonic()
+        if self.continuous:
+            period = 1 / self.push_rate
+            while t - self.t_pushed >= period:
+                self.t_pushed += period
+                self.advance_model(self.t_pushed)
+                self.reply(self.status_frame())
+        self.advance_model(t)
+
+
+class SimulatorLink:
+    # Serves an OCSimulator (on the real clock) over a local TCP socket or a pseudo
+    # terminal, as a stand-in for an OC behind a serial device server or on a serial port,
+    # so the transports in transport.py can be run against it:
+    #
+    #   link = SimulatorLink(OCSimulator(), "tcp")
+    #   oc = OC(link.address) # tcp://127.0.0.1:<port>, or pty:/dev/pts/<n>
+    #
+    # Commands from the client go to the simulator, one per '\r', and whatever it has to
+    # send is passed back every few milliseconds. A TCP link serves one client at a time.
+
+    def __init__(self, simulator, kind="tcp", host="127.0.0.1", port=0):
+        self.simulator = simulator
+        self.kind = kind
+        self.stopping = threading.Event()
+        if kind == "tcp":
+            self.server = socket.create_server((host, port))
+            self.address = "tcp://%s:%d" % self.server.getsockname()[:2]
+        elif kind == "pty":
+            import tty
+            self.master, self.slave = os.openpty()
+            tty.setraw(self.slave) # No echo and no translation of '\r'
+            self.address = "pty:" + os.ttyname(self.slave)
+        else:
+            raise ValueError("Unknown link %s, use tcp or pty" % kind)
+        self.simulator.open()
+        self.worker = threading.Thread(target=self.run, name="OC simulator link", daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.worker.join(1)
+        if self.kind == "tcp":
+            self.server.close()
+        else:
+            os.close(self.master)
+            os.close(self.slave)
+
+    def run(self):
+        if self.kind == "pty":
+            self.serve(lambda: os.read(self.master, 4096), lambda data: os.write(self.master, data), self.master)
+            return
+        while not self.stopping.is_set():
+            if not select.select([self.server], [], [], 0.05)[0]:
+                continue
+            connection = self.server.accept()[0]
+            with connection:
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.serve(lambda: connection.recv(4096), connection.sendall, connection)
+
+    def serve(self, receive, send, readable):
+        # Pass bytes both ways until the client goes or the link is stopped
+        command = bytearray()
+        while not self.stopping.is_set():
+            if select.select([readable], [], [], 0.005)[0]:
+                try:
+                    data = receive()
+                except OSError:
+                    data = b''
+                if not data:
+                    return # Client gone
+                command += data
+                while b'\r' in command:
+                    end = command.index(b'\r') + 1
+                    self.simulator.write(bytes(command[:end]))
+                    del command[:end]
+            reply = self.simulator.read(self.simulator.in_waiting)
+            if reply:
+                try:
+                    send(reply)
+                except OSError:
+                    return
@@ -0,0 +1,24 @@
+from PyQt5 import QtWidgets
+
+import sys, os
+
+basedir = os.path.dirname(__file__)
+
+# The window lives here rather than in OC.py so that scripts which only need the
+# serial driver can import OC without loading Qt.
+
+
+class MainWindow(QtWidgets.QMainWindow):
+
+    def __init__(self):
+        super().__init__()
+
+        self.setWindowTitle("ABHEY OC Controller")
+        self.setGeometry(100, 100, 800, 600)
+        self.show()
+
+
+if __name__ == '__main__':
+    app = QtWidgets.QApplication(sys.argv)
+    w = MainWindow()
+    app.exec()
@@ -0,0 +1,115 @@
+import heapq
+from itertools import count
+
+from clock import system_clock
+
+
+class AdaptivePoller:
+    # Decides how often to poll each of many OCs from what each one is doing, so the time on
+    # a shared serial bus goes to the ovens that need watching:
+    #
+    #  - with a fault, or the temperature changing faster than stable_slope [C/s] or more
+    #    than stable_band [C] from the setpoint, poll every min_interval seconds
+    #  - with the output disabled, poll every max_interval seconds
+    #  - once settled, or while an OC is not answering, stretch the interval by backoff
+    #    on every poll, up to max_interval
+    #
+    # OCs are kept in a heap ordered by when they are next due. Call tick() regularly (or
+    # after sleeping until next_time()) to poll every OC that is due. All times are on
+    # clock, which should be the one the OCs run on.
+
+    def __init__(self, min_interval=0.5, max_interval=10.0, stable_band=0.2, stable_slope=0.01,
+                 backoff=1.5, clock=system_clock):
+        self.min_interval = min_interval # [s]
+        self.max_interval = max_interval # [s]
+        self.stable_band = stable_band # [C]
+        self.stable_slope = stable_slope # [C/s]
+        self.backoff = backoff
+        self.clock = clock
+        self.devices = {} # key -> PolledOC
+        self.heap = [] # (due time, sequence, key)
+        self.sequence = count()
+
+    def add(self, key, oc, t=None):
+        # Start polling oc, straight away
+        t = self.clock.monotonic() if t is None else t
+        self.devices[key] = PolledOC(oc, self.min_interval)
+        self.schedule(key, t)
+
+    def remove(self, key):
+        self.devices.pop(key, None)
+
+    def schedule(self, key, t):
+        device = self.devices[key]
+        device.due = t
+        heapq.heappush(self.heap, (t, next(self.sequence), key))
+
+    def next_time(self):
+        # clock time the next OC is due, or None if there are none
+        while self.heap:
+            t, sequence, key = self.heap[0]
+            if key in self.devices and self.devices[key].due == t:
+                return t
+            heapq.heappop(self.heap) # Removed or rescheduled since
+        return None
+
+    def tick(self, t=None, poll=None):
+        # Poll every OC that is due and schedule its next poll. Returns the keys polled.
+        # poll(key) is called to do the polling if given, e.g. to take a lock around it, and
+        # returns True on success. By default the OC's get_status() is called. Everything
+        # is timed at t if given, otherwise the clock is read before each poll, as polls
+        # take time.
+        polled = []
+        read_clock = t is None
+        while True:
+            if read_clock:
+                t = self.clock.monotonic()
+            due = self.next_time()
+            if due is None or due > t:
+                return polled
+            key = heapq.heappop(self.heap)[2]
+            success = poll(key) if poll is not None else self.devices[key].oc.get_status()
+            self.polled(key, success, t)
+            polled.append(key)
+
+    def polled(self, key, success=True, t=None):
+        # Schedule the next poll of key, after it was polled (or sent a status) at t
+        t = self.clock.monotonic() if t is None else t
+        device = self.devices[key]
+        device.interval = self.choose_interval(device, success, t)
+        self.schedule(key, t + device.interval)
+        return device.interval
+
+    def choose_interval(self, device, success, t):
+        oc = device.oc
+        backed_off = min(self.max_interval, device.interval * self.backoff)
+        if not success:
+            return backed_off
+
+        temp = oc.temperature[0]
+        slope = 0
+        if device.last_time is not None and t > device.last_time:
+            slope = (temp - device.last_temp) / (t - device.last_time)
+        device.last_temp, device.last_time = temp, t
+
+        if oc.fault_code[0] != 0:
+            return self.min_interval
+        if oc.enable_state != 1:
+            return self.max_interval
+        if abs(slope) > self.stable_slope or abs(temp - oc.setpoint[0]) > self.stable_band:
+            return self.min_interval
+        return backed_off
+
+    def interval(self, key):
+        return self.devices[key].interval
+
+
+class PolledOC:
+    # What AdaptivePoller keeps for each OC
+
+    def __init__(self, oc, interval):
+        self.oc = oc
+        self.interval = interval # [s]
+        self.due = None # clock time of the next poll
+        self.last_temp = None
+        self.last_time = None
@@ -0,0 +1,92 @@
+import os
+import sys
+
+import serial.tools.list_ports
+from PyQt5.QtCore import QThread, pyqtSignal
+
+import OC
+
+sysfs_tty = '/sys/class/tty'
+
+
+def list_ports():
+    # Names of the serial ports currently present, mapped to something that identifies the
+    # adapter behind them (so a different adapter turning up under the same name is noticed).
+    # On Linux this only lists /sys/class/tty and follows one link per port, which is much
+    # cheaper than serial.tools.list_ports.comports() reading the USB details of every port.
+    if sys.platform.startswith('linux') and os.path.isdir(sysfs_tty):
+        ports = {}
+        for name in os.listdir(sysfs_tty):
+            device = os.path.join(sysfs_tty, name, 'device')
+            if not os.path.exists(device):
+                continue # virtual terminals, ptys etc.
+            if os.path.basename(os.path.realpath(os.path.join(device, 'subsystem'))) == 'platform':
+                continue # built in serial ports with nothing behind them, as comports() skips
+            ports[name] = os.path.realpath(device)
+        return ports
+
+    return {p.name: p.hwid for p in serial.tools.list_ports.comports()}
+
+
+class PortMonitor(QThread):
+    # Watches for serial ports appearing and disappearing from a background thread, so the
+    # GUI thread never waits on port enumeration. Only changes are signalled: port_added and
+    # port_removed carry the port name, and are delivered to slots in the GUI thread.
+    #
+    # With identify=True each new port is also asked whether it is an OC, and the result is
+    # signalled with port_identified(name, description). Results are cached by adapter, so
+    # unplugging and replugging the same adapter does not probe it again.
+    port_added = pyqtSignal(str)
+    port_removed = pyqtSignal(str)
+    port_identified = pyqtSignal(str, str)
+
+    def __init__(self, interval=1000, identify=False, parent=None):
+        super().__init__(parent)
+        self.interval = interval # Time between scans [ms]
+        self.identify = identify
+        self.ports = {}
+        self.identified = {} # adapter -> description, or None if it is not an OC
+        self.rescan_requested = False
+
+    def rescan(self):
+        # Scan again as soon as possible rather than waiting for the next interval
+        self.rescan_requested = True
+
+    def stop(self):
+        self.requestInterruption()
+        self.wait()
+
+    def run(self):
+        while not self.isInterruptionRequested():
+            self.scan()
+            self.rescan_requested = False
+            waited = 0
+            while waited < self.interval and not self.rescan_requested:
+                if self.isInterruptionRequested():
+                    return
+                self.msleep(50)
+                waited += 50
+
+    def scan(self):
+        ports = list_ports()
+
+        for name in sorted(self.ports):
+            if ports.get(name) != self.ports[name]:
+                self.port_removed.emit(name)
+        new = [name for name in sorted(ports) if self.ports.get(name) != ports[name]]
+        self.ports = ports
+
+        for name in new:
+            self.port_added.emit(name)
+        if self.identify:
+            for name in new:
+                self.identify_port(name, ports[name])
+
+    def identify_port(self, name, adapter):
+        if adapter not in self.identified:
+            try:
+                self.identified[adapter] = OC.identify_port(name) # Opens /dev/<name> on Linux
+            except Exception:
+                return # e.g. the port is in use; try again next time it appears
+        if self.identified[adapter] is not None:
+            self.port_identified.emit(name, self.identified[adapter].strip())
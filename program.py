@@ -0,0 +1,186 @@
+import heapq
+import math
+from collections import namedtuple
+from itertools import count
+
+from clock import system_clock
+from stability import StabilityDetector
+
+# Steps of a temperature program. A program is a list of these, e.g.
+#
+#   [Enable(), Ramp(80, 0.5), HoldUntilStable(0.1, 20), Hold(600), Ramp(40, 1), Disable()]
+#
+# Ramp sets the ramp rate (if given) and the setpoint, then waits until the temperature is
+# within tolerance of the target. Hold waits for a fixed time. HoldUntilStable waits until
+# the temperature has stayed within tolerance of the setpoint for hold_time seconds, and
+# fails the program if that has not happened within timeout seconds.
+Ramp = namedtuple('Ramp', ['target', 'rate', 'tolerance'], defaults=[None, 0.5])
+Hold = namedtuple('Hold', ['duration'])
+HoldUntilStable = namedtuple('HoldUntilStable', ['tolerance', 'hold_time', 'timeout'], defaults=[None])
+Enable = namedtuple('Enable', [])
+Disable = namedtuple('Disable', [])
+
+# Progress reported to ProgramRunner.on_event. kind is one of "started", "step_started",
+# "step_finished", "finished", "failed" or "cancelled". step_index and step are None for
+# events about the program as a whole, and message says why a program failed.
+ProgramEvent = namedtuple('ProgramEvent', ['name', 'kind', 'step_index', 'step', 'time', 'message'],
+                          defaults=[None])
+
+
+class ProgramFailed(Exception):
+    pass
+
+
+class ProgramRunner:
+    # Runs temperature programs on any number of OCs from a single thread.
+    #
+    # Each program is a generator which yields how long it wants to sleep for. The runner
+    # keeps every program in one heap ordered by wake-up time and never blocks on a device:
+    # status comes from the OCs' continuous output, which is read without waiting, and
+    # commands are only sent once an OC's write pacing allows it, so send_command() never
+    # has to pause. Programs are therefore independent of one another, and a slow or
+    # stalled oven only delays its own program.
+    #
+    # Call run() to block until every program has finished, or call tick() regularly
+    # (e.g. from a QTimer) to run the programs alongside other work. All times are on
+    # clock, which should be the one the OCs run on.
+
+    def __init__(self, poll_interval=0.2, on_event=None, clock=system_clock):
+        self.poll_interval = poll_interval # Longest time between reads of each OC [s]
+        self.on_event = on_event
+        self.clock = clock
+        self.programs = {}
+        self.heap = []
+        self.sequence = count()
+
+    def add(self, name, oc, steps):
+        # Start running a list of steps on an OC. name identifies the program in events.
+        if name in self.programs:
+            raise ValueError("A program called %s is already running" % name)
+        program = _Program(name, oc, list(steps), self)
+        self.programs[name] = program
+        self.schedule(program, self.clock.monotonic())
+
+    def cancel(self, name):
+        program = self.programs.pop(name, None)
+        if program is not None:
+            program.generator.close()
+            self.report(program, "cancelled")
+
+    def running(self):
+        return len(self.programs) > 0
+
+    def schedule(self, program, wake_time):
+        heapq.heappush(self.heap, (wake_time, next(self.sequence), program))
+
+    def tick(self):
+        # Service every program that is due. Returns the time until the next one is due [s].
+        now = self.clock.monotonic()
+        while self.heap and self.heap[0][0] <= now:
+            wake_time, _, program = heapq.heappop(self.heap)
+            if self.programs.get(program.name) is not program:
+                continue # cancelled
+
+            try:
+                program.oc.read_pushed_status()
+                if now < program.resume_time:
+                    # Only reading the OC this time round
+                    self.schedule(program, min(program.resume_time, now + self.poll_interval))
+                    continue
+
+                delay = next(program.generator)
+            except StopIteration:
+                del self.programs[program.name]
+                self.report(program, "finished")
+                continue
+            except Exception as e:
+                # A failure, e.g. the OC's port going away, only ends the program that caused it
+                del self.programs[program.name]
+                program.generator.close()
+                self.report(program, "failed", message=str(e))
+                continue
+
+            # Never due again in this tick, even if rounding has lost a tiny delay, such as
+            # what is left of the write pacing on a virtual clock
+            program.resume_time = max(now + delay, math.nextafter(now, math.inf))
+            self.schedule(program, min(program.resume_time, now + self.poll_interval))
+
+        if not self.heap:
+            return None
+        return max(0, self.heap[0][0] - self.clock.monotonic())
+
+    def run(self):
+        while self.running():
+            wait = self.tick()
+            if wait:
+                self.clock.sleep(wait)
+
+    def report(self, program, kind, step_index=None, message=None):
+        if self.on_event is None:
+            return
+        step = None if step_index is None else program.steps[step_index]
+        self.on_event(ProgramEvent(program.name, kind, step_index, step, self.clock.monotonic(), message))
+
+
+class _Program:
+
+    def __init__(self, name, oc, steps, runner):
+        self.name = name
+        self.oc = oc
+        self.steps = steps
+        self.runner = runner
+        self.resume_time = 0
+        self.generator = self.execute()
+
+    def execute(self):
+        # The OC is put into continuous output mode for the program, and left in it
+        self.runner.report(self, "started")
+        yield from self.write(self.oc.set_continuous_output)
+
+        for index, step in enumerate(self.steps):
+            self.runner.report(self, "step_started", index)
+            match step:
+                case Ramp():
+                    yield from self.ramp(step)
+                case Hold():
+                    yield step.duration
+                case HoldUntilStable():
+                    yield from self.hold_until_stable(step)
+                case Enable():
+                    yield from self.write(self.oc.enable)
+                case Disable():
+                    yield from self.write(self.oc.disable)
+                case other:
+                    raise ProgramFailed("Unknown program step %r" % (step,))
+            self.runner.report(self, "step_finished", index)
+
+    def write(self, command, *args):
+        # Wait, without blocking the runner, until the OC will accept a write, then send it
+        while not self.oc.ready_to_write():
+            yield self.oc.write_wait()
+        if not command(*args):
+            raise ProgramFailed("Could not write to the OC")
+
+    def ramp(self, step):
+        yield from self.write(self.oc.configure, step.target, step.rate)
+
+        status_time = self.oc.status_time
+        while True:
+            if self.oc.status_time != status_time:
+                status_time = self.oc.status_time
+                if abs(self.oc.temperature[0] - step.target) <= step.tolerance:
+                    return
+            yield self.runner.poll_interval
+
+    def hold_until_stable(self, step):
+        detector = StabilityDetector(step.tolerance, step.hold_time)
+        t_start = self.runner.clock.monotonic()
+        status_time = None
+        while not detector.stable:
+            if self.oc.status_time is not None and self.oc.status_time != status_time:
+                status_time = self.oc.status_time
+                detector.update_oc(self.oc)
+            if step.timeout is not None and self.runner.clock.monotonic() - t_start > step.timeout:
+                raise ProgramFailed("Temperature not stable after %3.1f s" % step.timeout)
+            if not detector.stable:
+                yield self.runner.poll_interval
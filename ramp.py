@@ -0,0 +1,91 @@
+from stability import WindowedLinearFit
+
+# The OC's fastest ramp rate, and its default. Set to this it steps to the setpoint rather
+# than ramping, so there is no rate to check. [C/s]
+NO_RAMP = 100
+
+
+class RampRateEstimator:
+    # Live estimate of how fast an oven is actually ramping.
+    #
+    # Each status sample updates a least squares fit over the last `window` seconds, so the
+    # achieved rate is known throughout the ramp rather than only from a fit over the whole
+    # run at the end. Memory is bounded by the window, not by the length of the run.
+    #
+    # The rate is compared with the ramp rate requested from the OC. An oven that cannot
+    # keep up (e.g. under-powered or badly insulated) shows up as a rate more than
+    # `tolerance` (a fraction of the requested rate) below what was asked for. There is no
+    # alarm once the temperature is within `band` of the setpoint, as the oven is holding
+    # there rather than ramping, nor while no ramp rate is expected.
+
+    def __init__(self, expected_rate=None, window=30, tolerance=0.2, setpoint=None, band=0.5):
+        self.expected_rate = expected_rate # units: C/s
+        self.window = window # units: s
+        self.tolerance = tolerance
+        self.setpoint = setpoint # units: C
+        self.band = band # units: C
+        self.temperature = None # Latest sample [C]
+        self.fit = WindowedLinearFit(window)
+
+    def reset(self):
+        self.fit.reset()
+
+    def update(self, t, temperature):
+        # t is in seconds from any fixed origin, e.g. OC.status_time. Returns the current
+        # rate estimate [C/s], or None until there are enough samples.
+        self.fit.add(t, temperature)
+        self.temperature = temperature
+        return self.rate()
+
+    def update_oc(self, oc):
+        # Feed the most recent status parsed by an OC object, taking the setpoint from it and
+        # the expected rate from the ramp rate last sent to it. No rate is expected while
+        # the output is off or the OC is set to step rather than ramp. A new setpoint or
+        # rate starts the fit afresh, so a window of the hold before it can not make the new
+        # ramp look too slow.
+        ramping = oc.enable_state == 1 and oc.ramp_rate < NO_RAMP
+        expected_rate = oc.ramp_rate if ramping else None
+        if oc.setpoint[0] != self.setpoint or expected_rate != self.expected_rate:
+            self.fit.reset()
+        self.expected_rate = expected_rate
+        self.setpoint = oc.setpoint[0]
+        return self.update(oc.status_time, oc.temperature[0])
+
+    def rate(self):
+        # Achieved rate of change of temperature [C/s]
+        return self.fit.slope()
+
+    def deviation(self):
+        # How much slower (negative) or faster (positive) than requested the oven is
+        # ramping [C/s], ignoring the direction of the ramp.
+        rate = self.rate()
+        if rate is None or self.expected_rate is None:
+            return None
+        return abs(rate) - self.expected_rate
+
+    def settled(self):
+        # True once the fit covers a whole window, so a single noisy sample at the start of
+        # the ramp cannot raise an alarm. Each sample stands for one interval, as evenly
+        # spaced samples never span quite the whole window.
+        n = self.fit.n
+        return n >= 2 and self.fit.span() * n / (n - 1) >= self.window
+
+    def arrived(self):
+        # True once the temperature is within band of the setpoint
+        if self.setpoint is None or self.temperature is None:
+            return False
+        return abs(self.temperature - self.setpoint) <= self.band
+
+    def too_slow(self):
+        deviation = self.deviation()
+        if deviation is None or not self.settled() or self.arrived():
+            return False
+        return deviation < -self.tolerance * self.expected_rate
+
+    def line(self):
+        # (t, temperature) of the centre of the fitted window and the fitted slope, e.g. for
+        # drawing the fit over the data
+        fit = self.fit
+        if fit.n < 2:
+            return None
+        return (fit.t_ref + fit.sum_t / fit.n, fit.sum_x / fit.n, fit.slope())
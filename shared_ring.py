@@ -0,0 +1,83 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+# Layout of the shared memory block: a header of int64 fields, padded to a cache line,
+# then capacity fixed layout records.
+header_fields = ['count', 'capacity', 'record_size', 'rate'] # rate is the sample rate [Hz] x 1000
+header_size = 64
+
+
+class SharedRing:
+    # Ring buffer of fixed layout records (a NumPy structured dtype) in shared memory, for
+    # handing samples from an acquisition process to the GUI process without pickling.
+    #
+    # One process writes with create=True and the others attach to it by name. count in
+    # the header is the number of records ever written. The writer stores the records
+    # before it moves count on, so a reader only sees whole records. read() returns NumPy
+    # views straight onto the shared memory. They are valid until the writer comes round
+    # to those slots again, which intact() checks.
+
+    def __init__(self, dtype, capacity=65536, name=None, create=False):
+        self.dtype = np.dtype(dtype)
+        size = header_size + capacity * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        self.name = self.shm.name
+        self.header = np.ndarray(len(header_fields), np.int64, self.shm.buf)
+        if create:
+            self.header[:] = 0
+            self.header[header_fields.index('capacity')] = capacity
+            self.header[header_fields.index('record_size')] = self.dtype.itemsize
+        elif self.header[header_fields.index('record_size')] != self.dtype.itemsize:
+            self.close()
+            raise ValueError("Shared ring %s does not hold %s records" % (name, self.dtype))
+        self.capacity = int(self.header[header_fields.index('capacity')])
+        self.records = np.ndarray(self.capacity, self.dtype, self.shm.buf, header_size)
+        self.owner = create
+
+    def count(self):
+        return int(self.header[0])
+
+    def set_rate(self, rate):
+        self.header[header_fields.index('rate')] = int(round(rate * 1000))
+
+    def rate(self):
+        return self.header[header_fields.index('rate')] / 1000
+
+    def write(self, columns):
+        # Append a block of records, given as an array per field
+        n = len(next(iter(columns.values())))
+        count = self.count()
+        skip = max(0, n - self.capacity)
+        start = (count + skip) % self.capacity
+        first = min(n - skip, self.capacity - start)
+        for name, values in columns.items():
+            self.records[name][start:start + first] = values[skip:skip + first]
+            self.records[name][:n - skip - first] = values[skip + first:]
+        self.header[0] = count + n
+
+    def read(self, since, limit=None):
+        # New records since count was since, as up to two views (the second is empty unless
+        # they wrap round the end of the ring). Also returns the count to pass next time and
+        # the number of records lost by falling more than capacity behind.
+        count = self.count()
+        lost = max(0, count - since - self.capacity)
+        since += lost
+        if limit is not None and count - since > limit:
+            lost += count - limit - since
+            since = count - limit
+        start = since % self.capacity
+        n = count - since
+        first = min(n, self.capacity - start)
+        return (self.records[start:start + first], self.records[:n - first]), count, lost
+
+    def intact(self, since):
+        # True if the records read from since on have not been overwritten since
+        return self.count() - since <= self.capacity
+
+    def close(self):
+        # Drop the views before closing, as the memory can not be released while they exist
+        self.header = None
+        self.records = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,174 @@
+'''
+Soak test of the OC driver: weeks of continuous output in accelerated time, to show that
+memory and CPU stay flat over the long runs the ovens do.
+
+python soak.py --days 21
+
+An OC is run against the simulator in oc_simulator.py on a clock.VirtualClock, handling a
+status message every second the way the GUIs do, with fallback polling (AdaptivePoller)
+and a StalenessWatchdog on top. The OC is wrapped in a SupervisedOC, as in test1.py.
+Setpoint changes, faults and disconnects (the OC going silent for --disconnect-for
+seconds, which the supervisor has to notice, back off from and reconnect after) are
+injected along the way. Every --checkpoint hours of
+simulated time the resident memory, the number of memory blocks allocated by Python
+(which counts objects of every type, strings included) and the CPU time per status
+message are recorded. The first --warm-up hours are given for the bounded histories
+(the OC's fault_queue, the plotted readings, ...) to fill up. After that none of the
+measurements may grow by more than the tolerances below. The CPU time is compared as the
+median over the first and the last third of the checkpoints after warm up, as single
+checkpoints are noisy. The exit code is 0 if they stay flat, 1 if not.
+'''
+
+import argparse
+import gc
+import os
+import random
+import resource
+import sys
+from collections import deque
+from statistics import median
+from time import process_time
+
+from clock import VirtualClock
+from OC import OC
+from polling import AdaptivePoller
+from staleness import StalenessWatchdog
+from supervisor import SupervisedOC
+
+HISTORY_LENGTH = 3600
+
+# Largest growth allowed after warm up
+RSS_TOLERANCE = 4 * 1024 * 1024 # [bytes]
+BLOCK_TOLERANCE = 0.01 # Fraction of the blocks allocated at the end of warm up
+CPU_TOLERANCE = 1.5 # Ratio of the CPU time per message at the end of the run to that at the start
+
+
+def rss():
+    # Resident memory of this process [bytes]
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # Peak, in kB on Linux
+
+
+class Soak:
+    # Drives the OC for a number of simulated days and keeps the checkpoints
+
+    def __init__(self, fault_every=1.0, disconnect_every=12.0, disconnect_for=120, setpoint_every=2.0, seed=1):
+        self.clock = VirtualClock()
+        self.oc = SupervisedOC(OC("sim", clock=self.clock), on_change=self.connection_change)
+        self.sim = self.oc.OC
+        self.sim.writes = deque(maxlen=0) # The pacing is not checked here, so keep no writes
+        self.poller = AdaptivePoller(clock=self.clock)
+        self.watchdog = StalenessWatchdog(timeout=3.0, clock=self.clock)
+        self.watchdog.watch_oc(self.oc, "oc")
+        self.events = {"stale": 0, "recovered": 0}
+        self.watchdog.on_event = lambda event: self.events.update({event.kind: self.events[event.kind] + 1})
+        self.history = deque(maxlen=HISTORY_LENGTH) # (time, temperature), as the GUIs plot
+        self.rng = random.Random(seed)
+        self.fault_every = fault_every * 3600 # [s]
+        self.disconnect_every = disconnect_every * 3600 # [s]
+        self.disconnect_for = disconnect_for # [s]
+        self.setpoint_every = setpoint_every * 3600 # [s]
+        self.messages = 0 # Status messages handled
+        self.drops = 0
+        self.reconnects = 0
+        self.checkpoints = [] # (hours, rss, allocated blocks, CPU per message [s])
+
+        self.oc.set_ramp_rate(0.1)
+        self.oc.enable()
+        self.oc.set_continuous_output()
+        self.poller.add("oc", self.oc)
+
+    def second(self, t):
+        # One second of the OC running, with whatever is due injected
+        if t % self.setpoint_every == 0:
+            self.oc.set_temperature(self.rng.uniform(30, 80))
+        if t % self.fault_every == 0:
+            self.sim.fault = self.rng.choice([1, 2, 4, 8, 16])
+        elif t % self.fault_every == 60:
+            self.sim.fault = 0
+        if t % self.disconnect_every == 0:
+            self.sim.responding = False
+        elif t % self.disconnect_every == self.disconnect_for:
+            self.sim.responding = True # For the supervisor to find on its next attempt
+
+        self.clock.sleep(1)
+        if self.oc.read_or_poll(self.poller.tick):
+            self.messages += 1
+        self.watchdog.advance()
+        self.history.append((self.clock.monotonic(), self.oc.temperature[0]))
+
+    def connection_change(self, change):
+        if change == "dropped":
+            self.drops += 1
+        else:
+            self.reconnects += 1
+
+    def run(self, days, checkpoint=6.0):
+        seconds = int(days * 86400)
+        step = int(checkpoint * 3600)
+        for start in range(0, seconds, step):
+            cpu, messages = process_time(), self.messages
+            for t in range(start, min(start + step, seconds)):
+                self.second(t)
+            per_message = (process_time() - cpu) / max(1, self.messages - messages)
+            gc.collect()
+            self.checkpoints.append((min(start + step, seconds) / 3600, rss(), sys.getallocatedblocks(), per_message))
+            hours, memory, blocks, per_message = self.checkpoints[-1]
+            print("%8.1f h  RSS %7.1f MB  blocks %8d  CPU %6.1f us/message" %
+                  (hours, memory / 1024 / 1024, blocks, per_message * 1e6), flush=True)
+
+    def check(self, warm_up=48.0):
+        # List of the ways the run failed to stay flat after warm_up hours, empty if it did
+        warming = [checkpoint for checkpoint in self.checkpoints if checkpoint[0] <= warm_up]
+        after = self.checkpoints[len(warming):]
+        if not warming or len(after) < 3:
+            return ["Too short to check, run for at least three checkpoints after warm up"]
+        hours, memory, blocks, per_message = warming[-1]
+        failures = []
+        for hours_now, memory_now, blocks_now, per_message_now in after:
+            if memory_now - memory > RSS_TOLERANCE:
+                failures.append("RSS grew by %.1f MB by %.1f h" % ((memory_now - memory) / 1024 / 1024, hours_now))
+            if blocks_now - blocks > BLOCK_TOLERANCE * blocks:
+                failures.append("%d more blocks allocated by %.1f h" % (blocks_now - blocks, hours_now))
+
+        third = len(after) // 3
+        cpu_start = median(checkpoint[3] for checkpoint in after[:third])
+        cpu_end = median(checkpoint[3] for checkpoint in after[-third:])
+        if cpu_end > CPU_TOLERANCE * cpu_start:
+            failures.append("CPU per message up %.1f times" % (cpu_end / cpu_start))
+        if self.events["stale"] == 0 or self.drops == 0:
+            failures.append("No disconnects were injected, run for longer than --disconnect-every")
+        elif self.reconnects < self.drops:
+            failures.append("%d drops but only %d reconnects" % (self.drops, self.reconnects))
+        return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Soak test the OC driver in accelerated time")
+    parser.add_argument('--days', type=float, default=21.0, help="Simulated time to run for [days]")
+    parser.add_argument('--checkpoint', type=float, default=6.0,
+                        help="Simulated time [h] between measurements of memory and CPU")
+    parser.add_argument('--warm-up', type=float, default=48.0,
+                        help="Simulated time [h] for the bounded histories to fill before anything is checked")
+    parser.add_argument('--fault-every', type=float, default=1.0, help="Time [h] between injected faults")
+    parser.add_argument('--disconnect-every', type=float, default=12.0,
+                        help="Time [h] between injected disconnects")
+    parser.add_argument('--disconnect-for', type=int, default=120,
+                        help="Time [s] the OC stays silent for in each disconnect")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    soak = Soak(args.fault_every, args.disconnect_every, args.disconnect_for, seed=args.seed)
+    soak.run(args.days, args.checkpoint)
+    print("%d status messages, %d faults kept, %d stale, %d recovered, %d drops, %d reconnects" %
+          (soak.messages, len(soak.oc.fault_queue), soak.events["stale"], soak.events["recovered"],
+           soak.drops, soak.reconnects))
+    failures = soak.check(args.warm_up)
+    for failure in failures:
+        print("FAIL:", failure)
+    if not failures:
+        print("PASS: memory and CPU stayed flat")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,206 @@
+from collections import deque
+
+
+class WindowedLinearFit:
+    # Least squares straight line through the (t, x) samples of the last `window` seconds.
+    # Each sample is added once and removed once, so the cost per sample is constant however
+    # long the window is. The running sums are kept relative to a reference time which is
+    # moved up (and the sums recomputed) every few windows, so that neither large values
+    # of t nor repeated add/subtract rounding degrade the fit on long runs.
+
+    def __init__(self, window):
+        self.window = window
+        self.samples = deque()
+        self.reset()
+
+    def reset(self):
+        self.samples.clear()
+        self.t_ref = None
+        self.n = 0
+        self.sum_t = 0.0
+        self.sum_x = 0.0
+        self.sum_tt = 0.0
+        self.sum_tx = 0.0
+
+    def add(self, t, x):
+        if self.t_ref is None:
+            self.t_ref = t
+        elif t - self.t_ref > 4 * self.window:
+            self.rebase(self.samples[0][0] if self.samples else t)
+
+        self.samples.append((t, x))
+        dt = t - self.t_ref
+        self.n += 1
+        self.sum_t += dt
+        self.sum_x += x
+        self.sum_tt += dt * dt
+        self.sum_tx += dt * x
+
+        # Drop samples that have fallen out of the window
+        while self.samples[0][0] < t - self.window:
+            t_old, x_old = self.samples.popleft()
+            dt = t_old - self.t_ref
+            self.n -= 1
+            self.sum_t -= dt
+            self.sum_x -= x_old
+            self.sum_tt -= dt * dt
+            self.sum_tx -= dt * x_old
+
+    def rebase(self, t_ref):
+        self.t_ref = t_ref
+        self.n = len(self.samples)
+        self.sum_t = self.sum_x = self.sum_tt = self.sum_tx = 0.0
+        for t, x in self.samples:
+            dt = t - t_ref
+            self.sum_t += dt
+            self.sum_x += x
+            self.sum_tt += dt * dt
+            self.sum_tx += dt * x
+
+    def span(self):
+        # Time covered by the samples currently in the window [s]
+        if len(self.samples) < 2:
+            return 0.0
+        return self.samples[-1][0] - self.samples[0][0]
+
+    def mean(self):
+        if self.n == 0:
+            return None
+        return self.sum_x / self.n
+
+    def slope(self):
+        # Gradient of the fitted line [x units/s], or None if there is not enough data
+        denominator = self.n * self.sum_tt - self.sum_t * self.sum_t
+        if self.n < 2 or denominator <= 0:
+            return None
+        return (self.n * self.sum_tx - self.sum_t * self.sum_x) / denominator
+
+
+class WindowedMax:
+    # Running maximum over the last `window` seconds, using a deque of decreasing values.
+    # Every value is pushed and popped at most once, so updates are O(1) amortised.
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+
+    def reset(self):
+        self.values.clear()
+
+    def add(self, t, x):
+        while self.values and self.values[-1][1] <= x:
+            self.values.pop()
+        self.values.append((t, x))
+        while self.values[0][0] < t - self.window:
+            self.values.popleft()
+
+    def max(self):
+        if not self.values:
+            return None
+        return self.values[0][1]
+
+
+class StabilityDetector:
+    # Decides when the temperature of one OC has settled on its setpoint.
+    #
+    # The temperature is stable once every sample over the last hold_time seconds has been
+    # within tolerance of the setpoint (and, if max_slope is given, the fitted drift over
+    # that time is no more than max_slope C/s). It only becomes unstable again when a
+    # sample is more than tolerance + hysteresis from the setpoint, so noise sitting right
+    # on the edge of the tolerance band does not make the state flicker. Changing the
+    # setpoint starts the detection again.
+    #
+    # update() returns "stable" or "unstable" when the state changes and None otherwise.
+
+    def __init__(self, tolerance, hold_time, hysteresis=None, max_slope=None):
+        self.tolerance = tolerance # units: C
+        self.hold_time = hold_time # units: s
+        self.hysteresis = tolerance / 2 if hysteresis is None else hysteresis # units: C
+        self.max_slope = max_slope # units: C/s
+        self.deviation = WindowedMax(hold_time)
+        self.fit = WindowedLinearFit(hold_time)
+        self.reset()
+
+    def reset(self):
+        self.deviation.reset()
+        self.fit.reset()
+        self.setpoint = None
+        self.t_start = None # Time of the first sample since the last reset
+        self.stable = False
+
+    def update(self, t, temperature, setpoint):
+        # t is in seconds from any fixed origin, e.g. OC.status_time
+        if setpoint != self.setpoint:
+            was_stable = self.stable
+            self.reset()
+            self.setpoint = setpoint
+            if was_stable:
+                return "unstable"
+
+        if self.t_start is None:
+            self.t_start = t
+
+        deviation = abs(temperature - setpoint)
+        self.deviation.add(t, deviation)
+        self.fit.add(t, temperature)
+
+        if self.stable:
+            if deviation > self.tolerance + self.hysteresis:
+                self.stable = False
+                return "unstable"
+        elif t - self.t_start >= self.hold_time and self.max_deviation() <= self.tolerance:
+            slope = self.slope()
+            if self.max_slope is None or (slope is not None and abs(slope) <= self.max_slope):
+                self.stable = True
+                return "stable"
+
+        return None
+
+    def update_oc(self, oc):
+        # Feed the most recent status parsed by an OC object
+        return self.update(oc.status_time, oc.temperature[0], oc.setpoint[0])
+
+    def max_deviation(self):
+        # Largest distance from the setpoint over the last hold_time seconds [C]
+        return self.deviation.max()
+
+    def mean(self):
+        # Mean temperature over the last hold_time seconds [C]
+        return self.fit.mean()
+
+    def slope(self):
+        # Temperature drift over the last hold_time seconds [C/s]
+        return self.fit.slope()
+
+
+class StabilityMonitor:
+    # One StabilityDetector per controller, fed from a shared acquisition loop. Events are
+    # passed to on_event(key, event) as well as being returned from update().
+
+    def __init__(self, tolerance, hold_time, hysteresis=None, max_slope=None, on_event=None):
+        self.settings = (tolerance, hold_time, hysteresis, max_slope)
+        self.on_event = on_event
+        self.detectors = {}
+
+    def detector(self, key):
+        if key not in self.detectors:
+            self.detectors[key] = StabilityDetector(*self.settings)
+        return self.detectors[key]
+
+    def update(self, key, t, temperature, setpoint):
+        event = self.detector(key).update(t, temperature, setpoint)
+        if event is not None and self.on_event is not None:
+            self.on_event(key, event)
+        return event
+
+    def update_oc(self, key, oc):
+        return self.update(key, oc.status_time, oc.temperature[0], oc.setpoint[0])
+
+    def remove(self, key):
+        self.detectors.pop(key, None)
+
+    def stable(self, key):
+        return key in self.detectors and self.detectors[key].stable
+
+    def all_stable(self):
+        return len(self.detectors) > 0 and all(d.stable for d in self.detectors.values())
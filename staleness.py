@@ -0,0 +1,124 @@
+import threading
+from collections import namedtuple
+from math import ceil
+
+from clock import system_clock
+
+# Reported to StalenessWatchdog.on_event. kind is "stale" when a device has sent nothing for
+# its timeout and "recovered" when it is heard from again. age is the time since it was
+# last heard from [s].
+WatchdogEvent = namedtuple('WatchdogEvent', ['key', 'kind', 'time', 'age'])
+
+
+class StalenessWatchdog:
+    # Notices devices that have stopped reporting, e.g. an OC in continuous output mode
+    # whose frames have stopped, or one whose get_status() keeps timing out.
+    #
+    # Devices are kept on a hashed timing wheel: a ring of slots, each resolution seconds
+    # wide, with each device in the slot of the time it will go stale. feed() moves a
+    # device to a new slot and advance() only looks at the slots whose time has come, so
+    # both cost the same however many devices are watched and there is no timer per
+    # device. A device whose timeout is longer than the wheel stays in its slot for as
+    # many turns as it needs. Staleness is noticed within one resolution of the timeout.
+    #
+    # Call advance() regularly, e.g. from a QTimer or a service's loop. Events are passed
+    # to on_event and also returned. feed() and advance() may be called from different
+    # threads. Times are on clock, which should be the one the devices are timed on.
+
+    def __init__(self, timeout=3.0, resolution=0.1, slots=None, on_event=None, t_start=None,
+                 clock=system_clock):
+        self.timeout = timeout # Default time without a report before a device is stale [s]
+        self.resolution = resolution # [s]
+        if slots is None:
+            slots = ceil(timeout / resolution) + 1
+        self.wheel = [set() for _ in range(slots)]
+        self.on_event = on_event
+        self.clock = clock
+        self.t_start = clock.monotonic() if t_start is None else t_start
+        self.tick = 0 # Every slot up to and including this tick has been dealt with
+        self.deadline = {} # key -> tick at which it goes stale
+        self.timeouts = {} # key -> timeout, for keys not using the default
+        self.last_seen = {} # key -> time it was last fed
+        self.listeners = {} # key -> (OC, status listener) for keys added with watch_oc()
+        self.stale = set()
+        self.lock = threading.RLock()
+
+    def tick_of(self, t):
+        return int((t - self.t_start) / self.resolution)
+
+    def watch(self, key, timeout=None, t=None):
+        # Start watching key, counting from now as if it had just reported
+        if timeout is not None:
+            self.timeouts[key] = timeout
+        self.feed(key, t)
+
+    def unwatch(self, key):
+        with self.lock:
+            if key in self.deadline:
+                self.wheel[self.deadline.pop(key) % len(self.wheel)].discard(key)
+            self.timeouts.pop(key, None)
+            self.last_seen.pop(key, None)
+            self.stale.discard(key)
+            if key in self.listeners:
+                oc, listener = self.listeners.pop(key)
+                oc.status_listeners.remove(listener)
+
+    def watch_oc(self, oc, key=None, timeout=None, t=None):
+        # Watch an OC, fed by every status message it parses until unwatch(key). Returns the
+        # key used.
+        key = oc if key is None else key
+        self.unwatch(key)
+        listener = lambda oc: self.feed(key, oc.status_time)
+        oc.status_listeners.append(listener)
+        self.listeners[key] = (oc, listener)
+        self.watch(key, timeout, t)
+        return key
+
+    def feed(self, key, t=None):
+        # key has just reported. O(1): it moves to the slot of its new deadline.
+        t = self.clock.monotonic() if t is None else t
+        with self.lock:
+            last_seen = self.last_seen.get(key, t)
+            self.last_seen[key] = t
+            if key in self.deadline:
+                self.wheel[self.deadline[key] % len(self.wheel)].discard(key)
+            # Rounded up, so a device is never reported stale early. Deadlines are never in
+            # a slot already dealt with.
+            timeout = self.timeouts.get(key, self.timeout)
+            deadline = max(ceil((t + timeout - self.t_start) / self.resolution), self.tick + 1)
+            self.deadline[key] = deadline
+            self.wheel[deadline % len(self.wheel)].add(key)
+            if key in self.stale:
+                self.stale.discard(key)
+                self.report(key, "recovered", t, t - last_seen)
+
+    def advance(self, t=None):
+        # Deal with every slot whose time has come. Returns the events raised.
+        t = self.clock.monotonic() if t is None else t
+        events = []
+        with self.lock:
+            now = self.tick_of(t)
+            if now - self.tick > len(self.wheel):
+                # More than a turn behind: each slot needs looking at only once
+                ticks = range(now - len(self.wheel) + 1, now + 1)
+            else:
+                ticks = range(self.tick + 1, now + 1)
+            for tick in ticks:
+                slot = self.wheel[tick % len(self.wheel)]
+                expired = [key for key in slot if self.deadline[key] <= now]
+                for key in expired:
+                    slot.discard(key)
+                    del self.deadline[key]
+                    self.stale.add(key)
+                    events.append(self.report(key, "stale", t, t - self.last_seen[key]))
+            self.tick = max(self.tick, now)
+        return events
+
+    def report(self, key, kind, t, age):
+        event = WatchdogEvent(key, kind, t, age)
+        if self.on_event is not None:
+            self.on_event(event)
+        return event
+
+    def is_stale(self, key):
+        return key in self.stale
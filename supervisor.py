@@ -0,0 +1,201 @@
+import random
+
+import serial.tools.list_ports
+
+import transport
+from OC import PUSH_TIMEOUT
+
+
+class SupervisedOC:
+    # Wraps an OC so that a dropped connection (e.g. a USB adapter unplugged or a flaky cable)
+    # is recovered from automatically instead of hanging or failing every later call.
+    #
+    # Commands are passed on to the OC. An error from the port, a failed command while the
+    # port is missing from the port list, or failures_to_drop failed commands in a row,
+    # marks the connection as dropped and closes the port. While
+    # dropped, calls return False straight away without touching the port (the circuit
+    # breaker is open) until the next reconnection attempt is due. Attempts are spaced by an
+    # exponential backoff from backoff up to max_backoff seconds, with a little jitter so a
+    # fleet of controllers on one hub does not retry in lock step. Once the port is back the
+    # last requested setpoint, ramp rate, output enable and continuous output mode are sent
+    # again. Requests made while the connection was down are included, so a disable() sent
+    # to an unplugged oven is still honoured when it comes back.
+    #
+    # Anything not wrapped here, such as the temperature and setpoint tuples, is read from
+    # the OC itself. The backoff is timed on clock, by default the OC's.
+
+    def __init__(self, oc, backoff=0.5, max_backoff=30, failures_to_drop=3, on_change=None, clock=None):
+        self.oc = oc
+        self.clock = oc.clock if clock is None else clock
+        self.backoff = backoff # units: s
+        self.max_backoff = max_backoff # units: s
+        self.failures_to_drop = failures_to_drop
+        self.on_change = on_change # Called with "dropped" or "reconnected"
+        self.connected = oc.OC_selected != "" and oc.OC.is_open
+        self.failures = 0 # Failed commands in a row
+        self.attempts = 0 # Failed reconnection attempts in a row
+        self.retry_time = 0 # clock time of the next reconnection attempt
+        self.last_error = None
+        self.requested = {} # Last value asked for of each part of the OC's state
+
+    def __getattr__(self, name):
+        return getattr(self.oc, name)
+
+    # ---------- Wrapped OC methods
+
+    def set_temperature(self, temp, force=False):
+        self.requested['temperature'] = temp
+        return self.call(self.oc.set_temperature, temp, force)
+
+    def set_ramp_rate(self, rate, force=False):
+        self.requested['ramp_rate'] = rate
+        return self.call(self.oc.set_ramp_rate, rate, force)
+
+    def queue_temperature(self, temp):
+        self.requested['temperature'] = temp
+        self.oc.queue_temperature(temp)
+
+    def queue_ramp_rate(self, rate):
+        self.requested['ramp_rate'] = rate
+        self.oc.queue_ramp_rate(rate)
+
+    def flush_commands(self):
+        return self.call(self.oc.flush_commands)
+
+    def enable(self, force=False):
+        self.requested['enabled'] = True
+        return self.call(self.oc.enable, force)
+
+    def disable(self, force=True):
+        self.requested['enabled'] = False
+        return self.call(self.oc.disable, force)
+
+    def set_continuous_output(self, force=False, rate=None, channel=None):
+        # The rate and channel are kept on the OC, so the same are asked for again after a
+        # reconnection, even if the connection is down now
+        if rate is not None:
+            if not self.oc.check_push_rate(rate):
+                return False
+            self.oc.push_rate = rate
+        if channel is not None:
+            if not self.oc.check_push_channel(channel):
+                return False
+            self.oc.push_channel = channel
+        self.requested['continuous'] = True
+        return self.call(self.oc.set_continuous_output, force)
+
+    def stop_continuous_output(self, force=False):
+        self.requested['continuous'] = False
+        return self.call(self.oc.stop_continuous_output, force)
+
+    def configure(self, temperature=None, ramp_rate=None, enabled=None, continuous=None, force=False):
+        changes = dict(temperature=temperature, ramp_rate=ramp_rate, enabled=enabled, continuous=continuous)
+        self.requested.update({k: v for k, v in changes.items() if v is not None})
+        return self.call(self.oc.configure, temperature, ramp_rate, enabled, continuous, force)
+
+    def reset_defaults(self):
+        return self.configure(temperature=40, ramp_rate=100, enabled=False, continuous=False)
+
+    def get_status(self, max_age=0):
+        return self.call(self.oc.get_status, max_age)
+
+    def get_temperature(self, max_age=None):
+        self.get_status(self.oc.status_max_age if max_age is None else max_age)
+        return self.oc.temperature[0]
+
+    def get_faults(self, max_age=None):
+        self.get_status(self.oc.status_max_age if max_age is None else max_age)
+        return self.oc.fault_code[0]
+
+    def read_pushed_status(self):
+        # No status while the connection is down, rather than an exception
+        return self.call(self.oc.read_pushed_status, counts=False) is True
+
+    def read_or_poll(self, poll, push_timeout=PUSH_TIMEOUT):
+        # As the OC's, with the read supervised here and poll() (normally polling through
+        # this object) supervised on its own
+        return self.read_pushed_status() or (self.oc.push_overdue(push_timeout) and bool(poll()))
+
+    def OC_close(self):
+        self.connected = False
+        self.oc.OC_close()
+
+    # ---------- Supervision
+
+    def call(self, method, *args, counts=True):
+        # Run one OC method. Returns its result, or False if the OC is not reachable.
+        if not self.connected and not self.reconnect():
+            return False
+        try:
+            result = method(*args)
+        except OSError as e: # includes serial.SerialException
+            self.drop(e)
+            return False
+
+        if result is False and counts:
+            # send_command() reports write errors by returning False, so check whether the
+            # adapter has gone rather than waiting for more failures
+            self.failures += 1
+            if not self.port_present():
+                self.drop("Port %s has gone" % self.oc.OC_selected)
+            elif self.failures >= self.failures_to_drop:
+                self.drop("No response after %d attempts" % self.failures)
+        elif result is not False:
+            self.failures = 0
+        return result
+
+    def drop(self, error):
+        self.last_error = error
+        self.connected = False
+        self.failures = 0
+        self.retry_time = self.clock.monotonic()
+        try:
+            self.oc.OC_close()
+        except Exception:
+            pass
+        if self.on_change is not None:
+            self.on_change("dropped")
+
+    def reconnect(self):
+        now = self.clock.monotonic()
+        if now < self.retry_time:
+            return False
+
+        success = False
+        if self.port_present():
+            try:
+                self.oc.setup_port()
+                success = self.oc.OC_open() and self.restore()
+            except Exception as e:
+                self.last_error = e
+                success = False
+
+        if success:
+            self.connected = True
+            self.attempts = 0
+            if self.on_change is not None:
+                self.on_change("reconnected")
+        else:
+            try:
+                self.oc.OC_close()
+            except Exception:
+                pass
+            delay = min(self.max_backoff, self.backoff * 2 ** self.attempts)
+            self.retry_time = now + delay * random.uniform(1, 1.1)
+            self.attempts += 1
+        return success
+
+    def port_present(self):
+        if not transport.is_serial_port(self.oc.OC_selected):
+            return True # Only serial ports are listed, anything else is tried
+        name = transport.serial_port_name(self.oc.OC_selected).lower()
+        return any(p.name.lower() == name for p in serial.tools.list_ports.comports())
+
+    def restore(self):
+        # Send the last requested state again
+        requested = self.requested
+        return self.oc.configure(requested.get('temperature'),
+                                 requested.get('ramp_rate'),
+                                 requested.get('enabled'),
+                                 True if requested.get('continuous') else None,
+                                 force=True)
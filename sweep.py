@@ -0,0 +1,114 @@
+import threading
+from time import monotonic
+
+import numpy as np
+
+import LDPD
+
+
+class Sweep:
+    # An LD current waveform, worked out in full before it is run: points [mA] played at
+    # point_rate [points/s], with the module's sine modulation of frequency [Hz] and
+    # amplitude [mA peak to peak] on top. The commands carrying the points are built here
+    # too, chunk points each, so running the sweep is nothing but writes.
+
+    def __init__(self, points, point_rate=100, frequency=0, amplitude=0, chunk=32):
+        self.points = np.asarray(points, dtype=float)
+        self.point_rate = point_rate
+        self.frequency = frequency
+        self.amplitude = amplitude
+        microamps = np.round(self.points * 1000).astype(int)
+        self.chunks = [(LDPD.points_command(microamps[i:i + chunk]), len(microamps[i:i + chunk]))
+                       for i in range(0, len(microamps), chunk)]
+
+    def duration(self):
+        # [s]
+        return len(self.points) / self.point_rate
+
+
+def slope_sweep(start, end, slope, point_rate=100, frequency=0, amplitude=0):
+    # Ramp from start to end [mA] at slope [mA/s]
+    n = max(2, int(round(abs(end - start) / slope * point_rate)) + 1)
+    return Sweep(np.linspace(start, end, n), point_rate, frequency, amplitude)
+
+
+def dc_sweep(level, point_rate=100, frequency=0, amplitude=0):
+    # Hold the current at level [mA]
+    return Sweep([level], point_rate, frequency, amplitude)
+
+
+class SweepRunner:
+    # Plays a Sweep on an LDPD from a worker thread. A chunk is only sent while the module
+    # has less than lead seconds of the sweep left to play, so it never holds more than
+    # lead seconds and one chunk of it.
+    # stop() halts the current from the calling thread straight away, without waiting for
+    # the worker, then again once the worker has stopped. The module holds the last point
+    # once the sweep has played.
+
+    def __init__(self, ldpd, sweep, lead=0.5, on_finished=None):
+        self.ldpd = ldpd
+        self.sweep = sweep
+        self.lead = lead # [s]
+        self.on_finished = on_finished # Called from the worker with True if the sweep played out
+        self.stopping = threading.Event()
+        self.t_start = None # monotonic time the first point was sent
+        self.sent = 0 # Points sent so far
+        self.error = None
+        self.worker = threading.Thread(target=self.run, name="Sweep", daemon=True)
+
+    def start(self):
+        self.worker.start()
+
+    def stop(self):
+        self.stopping.set()
+        racing = self.worker.is_alive() and threading.current_thread() is not self.worker
+        self.ldpd.halt_current()
+        if racing:
+            # The worker may have been sending a chunk as the halt went out, which would
+            # bring the current back. Once it has finished nothing else is sent, so halt again.
+            self.worker.join(1)
+            self.ldpd.halt_current()
+
+    def running(self):
+        return self.worker.is_alive()
+
+    def played(self):
+        # Points the module has played so far
+        if self.t_start is None:
+            return 0
+        return min(self.sent, int((monotonic() - self.t_start) * self.sweep.point_rate))
+
+    def progress(self):
+        # Fraction of the sweep played, 0 to 1
+        return self.played() / max(1, len(self.sweep.points))
+
+    def run(self):
+        sweep = self.sweep
+        completed = False
+        try:
+            if not (self.ldpd.set_point_rate(sweep.point_rate)
+                    and self.ldpd.set_modulation(sweep.frequency, sweep.amplitude)):
+                raise IOError("Could not set up the sweep on the LD-PD module")
+
+            for cmd, n in sweep.chunks:
+                # Wait until there is room within lead seconds of the playing point
+                while self.t_start is not None and not self.stopping.is_set():
+                    ahead = (self.sent - self.played()) / sweep.point_rate
+                    if ahead < self.lead:
+                        break
+                    self.stopping.wait(ahead - self.lead + 0.5 * n / sweep.point_rate)
+                if self.stopping.is_set():
+                    break
+                if not self.ldpd.send_command(cmd):
+                    raise IOError("Could not send the sweep to the LD-PD module")
+                if self.t_start is None:
+                    self.t_start = monotonic()
+                self.sent += n
+
+            # Wait for the last points to play
+            remaining = (self.sent - self.played()) / sweep.point_rate
+            completed = not self.stopping.wait(remaining)
+        except Exception as e:
+            self.error = e
+        if self.on_finished is not None:
+            self.on_finished(completed)
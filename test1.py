@@ -1,5 +1,4 @@
 import sys
-import serial.tools.list_ports
 from PyQt5.QtCore import QTimer, Qt
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget,
@@ -8,13 +7,20 @@ from PyQt5.QtWidgets import (
     QGroupBox, QMessageBox
 )
 
-import pyqtgraph as pg
 from datetime import datetime
 
 import sys, os
 
 # import your OC class
-#from OC import OC
+from OC import OC
+from port_monitor import PortMonitor
+from supervisor import SupervisedOC
+from polling import AdaptivePoller
+from transport import is_serial_port
+
+# How often to send queued commands and check the OC's status has arrived, polling for it
+# if not, see OC.read_or_poll(). Pushed status is shown as it arrives. [ms]
+PUSH_CHECK_INTERVAL = 100
 
 
 class OCMainWindow(QMainWindow):
@@ -31,6 +37,7 @@ class OCMainWindow(QMainWindow):
         # timer for live updates
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_status)
+        self.poller = AdaptivePoller()
 
     def init_ui(self):
         central = QWidget()
@@ -42,8 +49,16 @@ class OCMainWindow(QMainWindow):
         conn_group = QGroupBox("Connection")
         conn_layout = QHBoxLayout()
 
+        # The port list is kept up to date by a background monitor
         self.port_combo = QComboBox()
-        self.refresh_ports()
+        self.port_monitor = PortMonitor(parent=self)
+        self.port_monitor.port_added.connect(self.add_port)
+        self.port_monitor.port_removed.connect(self.remove_port)
+        self.port_monitor.start()
+
+        # A rescan picks up any change the monitor has not reached yet
+        self.refresh_btn = QPushButton("Refresh")
+        self.refresh_btn.clicked.connect(self.refresh_ports)
 
         self.connect_btn = QPushButton("Connect")
         self.connect_btn.clicked.connect(self.connect_oc)
@@ -54,6 +69,7 @@ class OCMainWindow(QMainWindow):
 
         conn_layout.addWidget(QLabel("COM Port:"))
         conn_layout.addWidget(self.port_combo)
+        conn_layout.addWidget(self.refresh_btn)
         conn_layout.addWidget(self.connect_btn)
         conn_layout.addWidget(self.disconnect_btn)
         conn_group.setLayout(conn_layout)
@@ -81,6 +97,8 @@ class OCMainWindow(QMainWindow):
         self.temp_spin = QDoubleSpinBox()
         self.temp_spin.setRange(0, 300)
         self.temp_spin.setSuffix(" °C")
+        self.temp_spin.setKeyboardTracking(False) # Only once typing is finished, not 1, 15, 150
+        self.temp_spin.valueChanged.connect(self.queue_temperature)
 
         self.set_temp_btn = QPushButton("Set Temperature")
         self.set_temp_btn.clicked.connect(self.set_temperature)
@@ -98,6 +116,8 @@ class OCMainWindow(QMainWindow):
         self.ramp_spin.setRange(0.01, 100)
         self.ramp_spin.setSuffix(" °C/s")
         self.ramp_spin.setValue(100)
+        self.ramp_spin.setKeyboardTracking(False)
+        self.ramp_spin.valueChanged.connect(self.queue_ramp)
 
         self.set_ramp_btn = QPushButton("Set Ramp Rate")
         self.set_ramp_btn.clicked.connect(self.set_ramp)
@@ -132,16 +152,32 @@ class OCMainWindow(QMainWindow):
     # ================= Logic =================
 
     def refresh_ports(self):
-        self.port_combo.clear()
-        ports = serial.tools.list_ports.comports()
-        for p in ports:
-            self.port_combo.addItem(p.name)
+        self.port_monitor.rescan()
+
+    def add_port(self, name):
+        if self.port_combo.findText(name) < 0:
+            self.port_combo.addItem(name)
+
+    def remove_port(self, name):
+        index = self.port_combo.findText(name)
+        if index >= 0:
+            self.port_combo.removeItem(index)
+
+    def closeEvent(self, event):
+        self.port_monitor.stop()
+        event.accept()
 
     def connect_oc(self):
         port = self.port_combo.currentText()
+        if is_serial_port(port):
+            port = "qt:" + port # Read as Qt's readyRead fires, see OC.data_arrived()
         try:
-            self.oc = OC(port)
-            self.timer.start(1000)
+            # The supervisor reconnects and restores the settings if the port drops out
+            self.oc = SupervisedOC(OC(port))
+            self.oc.status_listeners.append(self.show_status)
+            self.oc.set_continuous_output()
+            self.poller.add("oc", self.oc)
+            self.timer.start(PUSH_CHECK_INTERVAL)
 
             self.connect_btn.setEnabled(False)
             self.disconnect_btn.setEnabled(True)
@@ -156,6 +192,8 @@ class OCMainWindow(QMainWindow):
     def disconnect_oc(self):
         if self.oc:
             self.timer.stop()
+            self.poller.remove("oc")
+            self.oc.stop_continuous_output()
             self.oc.OC_close()
             self.oc = None
 
@@ -178,23 +216,42 @@ class OCMainWindow(QMainWindow):
         if self.oc:
             self.oc.set_ramp_rate(self.ramp_spin.value())
 
+    def queue_temperature(self, value):
+        # Changes made while the spin box is being scrolled are coalesced, so only the
+        # latest value is sent each time the OC can take a write. A typed value only
+        # arrives here once it is entered (keyboard tracking is off).
+        if self.oc:
+            self.oc.queue_temperature(value)
+
+    def queue_ramp(self, value):
+        if self.oc:
+            self.oc.queue_ramp_rate(value)
+
     def update_status(self):
         if not self.oc:
             return
 
+        self.oc.flush_commands()
+
         try:
-            temp = self.oc.get_temperature()
-            self.temp_label.setText(f"Temperature: {temp:.2f} °C")
-            self.setpoint_label.setText(f"Setpoint: {self.oc.setpoint[0]:.2f} °C")
-
-            fault = self.oc.get_faults()
-            if fault != 0:
-                self.fault_label.setText(f"Fault Code: {fault}")
-            else:
-                self.fault_label.setText("Fault: None")
-
-        except Exception:
-            pass
+            self.oc.read_or_poll(self.poller.tick) # Shown by show_status()
+        except Exception as e:
+            self.fault_label.setText(f"Error: {e}")
+
+        if not self.oc.connected:
+            self.fault_label.setText(f"Connection lost, reconnecting: {self.oc.last_error}")
+
+    def show_status(self, oc):
+        # Called by the OC after each status message it parses, pushed or polled
+        temp = oc.temperature[0]
+        self.temp_label.setText(f"Temperature: {temp:.2f} °C")
+        self.setpoint_label.setText(f"Setpoint: {oc.setpoint[0]:.2f} °C")
+
+        fault = oc.fault_code[0]
+        if fault != 0:
+            self.fault_label.setText(f"Fault Code: {fault}")
+        else:
+            self.fault_label.setText("Fault: None")
 
 
 if __name__ == "__main__":
@@ -9,9 +9,19 @@ from PyQt5.QtWidgets import (
 )
 
 import pyqtgraph as pg
+from collections import deque
 from datetime import datetime
 
 from OC import OC
+from acquisition import AcquisitionOC
+from polling import AdaptivePoller
+
+PUSH_CHECK_INTERVAL = 100 # How often to read the OC's pushed status, see OC.read_or_poll() [ms]
+
+# The GUI is left running for weeks, so only this many of the latest readings are plotted
+# and this many lines kept in the fault history
+HISTORY_LENGTH = 3600
+FAULT_LINES = 1000
 
 
 # ---------------- Fault Window ----------------
@@ -24,6 +34,7 @@ class FaultWindow(QWidget):
         layout = QVBoxLayout()
         self.text = QTextEdit()
         self.text.setReadOnly(True)
+        self.text.document().setMaximumBlockCount(FAULT_LINES) # Oldest lines are dropped
 
         layout.addWidget(self.text)
         self.setLayout(layout)
@@ -34,22 +45,27 @@ class FaultWindow(QWidget):
 
 # ---------------- Main GUI ----------------
 class OCMainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, acquisition_process=False):
         super().__init__()
+        # With acquisition_process the OC is read and polled by a separate process, so
+        # drawing the plot can never delay its messages
+        self.acquisition_process = acquisition_process
         self.setWindowTitle("ABHEY OC Controller")
         self.resize(900, 600)
 
         self.oc = None
         self.fault_window = FaultWindow()
 
-        self.temp_history = []
-        self.time_history = []
+        self.temp_history = deque(maxlen=HISTORY_LENGTH)
+        self.time_history = deque(maxlen=HISTORY_LENGTH)
+        self.readings = 0 # Readings taken, the x axis of the plot
 
         self.init_ui()
         self.apply_dark_theme()
 
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_status)
+        self.poller = AdaptivePoller()
 
     def init_ui(self):
         central = QWidget()
@@ -165,27 +181,46 @@ class OCMainWindow(QMainWindow):
         """)
 
     def connect_oc(self):
-        self.oc = OC(self.port_combo.currentText())
-        self.timer.start(1000)
+        if self.acquisition_process:
+            self.oc = AcquisitionOC(self.port_combo.currentText()) # Starts continuous output itself
+        else:
+            self.oc = OC(self.port_combo.currentText())
+            self.oc.set_continuous_output()
+            self.poller.add("oc", self.oc)
+        self.timer.start(PUSH_CHECK_INTERVAL)
+
+    def closeEvent(self, event):
+        if self.oc:
+            self.timer.stop()
+            self.oc.OC_close()
+        event.accept()
 
     def update_status(self):
         if not self.oc:
             return
 
-        temp = self.oc.get_temperature()
+        if self.acquisition_process:
+            received = self.oc.read_status()
+        else:
+            received = self.oc.read_or_poll(self.poller.tick)
+        if not received:
+            return
+
+        temp = self.oc.temperature[0]
         setp = self.oc.setpoint[0]
 
-        t = len(self.temp_history)
+        t = self.readings
+        self.readings += 1
         self.temp_history.append(temp)
         self.time_history.append(t)
 
-        self.temp_curve.setData(self.time_history, self.temp_history)
-        self.set_curve.setData(self.time_history, [setp] * len(self.time_history))
+        self.temp_curve.setData(list(self.time_history), list(self.temp_history))
+        self.set_curve.setData(list(self.time_history), [setp] * len(self.time_history))
 
         self.temp_label.setText(f"Temp: {temp:.2f} °C")
         self.setpoint_label.setText(f"Setpoint: {setp:.2f} °C")
 
-        fault = self.oc.get_faults()
+        fault = self.oc.fault_code[0]
         if fault != 0:
             msg = f"{datetime.now()} | Fault code: {fault}"
             self.fault_window.add_fault(msg)
@@ -193,6 +228,6 @@ class OCMainWindow(QMainWindow):
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
-    win = OCMainWindow()
+    win = OCMainWindow(acquisition_process="--acquisition-process" in sys.argv)
     win.show()
     sys.exit(app.exec_())
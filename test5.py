@@ -1,3 +1,6 @@
+from time import perf_counter
+t_start = perf_counter() # For reporting the time taken to show the window
+
 import sys, os
 
 
@@ -27,6 +30,11 @@ from PyQt5.QtWidgets import (
     QSystemTrayIcon,
     QLCDNumber)
  
+# All the images, compiled from resources.qrc. Rebuild after changing any of them with:
+#   pyrcc5 resources.qrc -o resources_rc.py
+import resources_rc
+from gui_startup import FirstFrame, LazyPanel
+
 basedir = os.path.dirname(__file__)
 
 class MainWindow(QMainWindow):
@@ -35,12 +43,12 @@ class MainWindow(QMainWindow):
 
         self.setWindowTitle("IITD EQUIP LAB")
         self.setGeometry(100, 100, 1000, 600)
-        self.setWindowIcon(QIcon("iitdelhilogo.jpg"))
+        self.setWindowIcon(QIcon(":/icons/iitdelhilogo.jpg"))
 
         label = QLabel(self)
         label.setGeometry(0, 0, 100, 100)
 
-        pixmap = QPixmap("iitdnqmdst.png")
+        pixmap = QPixmap(":/icons/iitdnqmdst.png")
         label.setPixmap(pixmap)
         label.setAlignment(Qt.AlignLeft | Qt.AlignTop)
 
@@ -51,7 +59,7 @@ class MainWindow(QMainWindow):
         image2_label = QLabel(self)
         image2_label.setGeometry(0, 0, 100, 100)
 
-        pixmap = QPixmap("equiplogo.png")
+        pixmap = QPixmap(":/icons/equiplogo.png")
         image2_label.setPixmap(pixmap)
         image2_label.setAlignment(Qt.AlignRight | Qt.AlignTop)      
         image2_label.setScaledContents(True)
@@ -81,18 +89,27 @@ class MainWindow(QMainWindow):
         content_layout = QHBoxLayout()
         main_layout.addLayout(content_layout)
 
+        # The waveform and demodulator panels are filled in once the window is on screen
+        waveform = LazyPanel("Waveform", self.waveform_panel)
+        demodulator = LazyPanel("Demodulator", self.demodulator_panel)
+
         content_layout.addWidget(self.temperature_panel(), 1)
-        content_layout.addWidget(self.waveform_panel(), 3)
-        content_layout.addWidget(self.demodulator_panel(), 1)
+        content_layout.addWidget(waveform, 3)
+        content_layout.addWidget(demodulator, 1)
 
         main_layout.addLayout(self.bottom_controls())
 
+        self.first_frame = FirstFrame(self, t_start)
+        self.first_frame.shown.connect(waveform.build_contents)
+        self.first_frame.shown.connect(demodulator.build_contents)
+        self.first_frame.shown.connect(self.report_startup)
+
  # ---------------- Instrument Bar ----------------
     def instrument_bar(self):
         layout = QHBoxLayout()
 
         btn_refresh = QPushButton("Refresh")
-        btn_refresh.setIcon(QIcon("arrow.png"))
+        btn_refresh.setIcon(QIcon(":/icons/arrow.png"))
         layout.addWidget(btn_refresh)
 
         #layout.addWidget(QPushButton("Refresh"))
@@ -105,7 +122,7 @@ class MainWindow(QMainWindow):
 
 
         btn_connect = QPushButton("Connect")
-        btn_connect.setIcon(QIcon("plug.png"))
+        btn_connect.setIcon(QIcon(":/icons/plug.png"))
         layout.addWidget(btn_connect)
         layout.addStretch()
 
@@ -152,7 +169,7 @@ class MainWindow(QMainWindow):
 
         layout.addWidget(self.temp_set, 5, 1)
         btn_temp = QPushButton("Set Temperature")
-        btn_temp.setIcon(QIcon("temperature.png"))
+        btn_temp.setIcon(QIcon(":/icons/temperature.png"))
         layout.addWidget(btn_temp, 6, 1)
         
 
@@ -161,7 +178,6 @@ class MainWindow(QMainWindow):
 
     # ---------------- Waveform Panel ----------------
     def waveform_panel(self):
-        box = QGroupBox("Waveform")
         layout = QGridLayout()
 
         layout.addWidget(QLabel("Start (mA)"), 0, 0)
@@ -185,16 +201,14 @@ class MainWindow(QMainWindow):
 
 
         btn_para = QPushButton("Set Parameters")
-        btn_para.setIcon(QIcon("settings.png"))
+        btn_para.setIcon(QIcon(":/icons/settings.png"))
         layout.addWidget(btn_para, 5, 1)
         
 
-        box.setLayout(layout)
-        return box
+        return layout
 
     # ---------------- Demodulator Panel ----------------
     def demodulator_panel(self):
-        box = QGroupBox("Demodulator")
         layout = QGridLayout()
 
         layout.addWidget(QLabel("Output"), 0, 0)
@@ -220,32 +234,36 @@ class MainWindow(QMainWindow):
 
 
         btn_set = QPushButton("Set")
-        btn_set.setIcon(QIcon("set.png"))
+        btn_set.setIcon(QIcon(":/icons/set.png"))
         layout.addWidget(btn_set, 4, 0, 1, 2)
         
 
-        box.setLayout(layout)
-        return box
+        return layout
+
+    # ---------------- Startup time ----------------
+    def report_startup(self, elapsed):
+        self.statusBar().showMessage("Started in %.0f ms" % (elapsed * 1000), 10000)
+        print("Time to first frame: %.0f ms" % (elapsed * 1000))
 
     # ---------------- Bottom Controls ----------------
     def bottom_controls(self):
         layout = QHBoxLayout()
 
         btn_runslope = QPushButton("Run: Slope")
-        btn_runslope.setIcon(QIcon("slope.png"))
+        btn_runslope.setIcon(QIcon(":/icons/slope.png"))
         layout.addWidget(btn_runslope)
 
         btn_rundc = QPushButton("Run: DC")
-        btn_rundc.setIcon(QIcon("code.png"))
+        btn_rundc.setIcon(QIcon(":/icons/code.png"))
         layout.addWidget(btn_rundc)
 
         btn_stop = QPushButton("Stop")
-        btn_stop.setIcon(QIcon("stop.png"))
+        btn_stop.setIcon(QIcon(":/icons/stop.png"))
         layout.addWidget(btn_stop)
 
         layout.addStretch()
         btn_save = QPushButton("Save All Settings")
-        btn_save.setIcon(QIcon("save.png"))
+        btn_save.setIcon(QIcon(":/icons/save.png"))
         layout.addWidget(btn_save)
         return layout
 
@@ -255,7 +273,7 @@ class MainWindow(QMainWindow):
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
-    app.setWindowIcon(QIcon(os.path.join(basedir, "icons", "iitdelhilogo.ico")))
+    app.setWindowIcon(QIcon(":/icons/iitdelhilogo.ico"))
     window = MainWindow()
     window.show()
     sys.exit(app.exec_())  # Corrected to sys.exit
@@ -0,0 +1,175 @@
+'''
+Timing of the OC driver, checked against the simulator in oc_simulator.py on a
+clock.VirtualClock, so every interval is exact and the tests take no real time.
+
+python -m unittest test_oc_timing
+'''
+
+import unittest
+
+from clock import VirtualClock
+from OC import OC
+from program import ProgramRunner, Ramp
+from ramp import RampRateEstimator
+from staleness import StalenessWatchdog
+
+
+class OCTimingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.oc = OC("sim", clock=self.clock)
+        self.sim = self.oc.OC
+        self.sim.writes.clear() # Leave out the identification
+        self.oc.read_available_bytes()
+
+    def write_times(self):
+        return [t for t, cmd in self.sim.writes]
+
+    def test_writes_are_paced(self):
+        self.assertTrue(self.oc.set_ramp_rate(1))
+        self.assertTrue(self.oc.set_temperature(50))
+        self.assertTrue(self.oc.enable())
+        self.assertTrue(self.oc.get_status())
+        times = self.write_times()
+        self.assertEqual(len(times), 4)
+        for before, after in zip(times, times[1:]):
+            self.assertAlmostEqual(after - before, self.oc.write_interval)
+        self.assertEqual(self.sim.ignored, 0)
+
+    def test_first_write_is_not_held_back(self):
+        t = self.clock.monotonic()
+        self.oc.last_write_time = None
+        self.assertTrue(self.oc.enable())
+        self.assertEqual(self.write_times(), [t])
+
+    def test_status_request_times_out(self):
+        self.sim.responding = False
+        t = self.clock.monotonic()
+        self.assertFalse(self.oc.get_status())
+        waited = self.clock.monotonic() - t
+        self.assertGreater(waited, 3)
+        self.assertLess(waited, 3 + self.oc.write_interval + 0.01)
+
+    def test_status_reused_within_max_age(self):
+        self.assertTrue(self.oc.get_status())
+        self.clock.sleep(1)
+        self.assertTrue(self.oc.get_status(max_age=1.5))
+        self.assertEqual(len(self.sim.writes), 1)
+        self.clock.sleep(1)
+        self.assertTrue(self.oc.get_status(max_age=1.5))
+        self.assertEqual(len(self.sim.writes), 2)
+
+    def test_ack_updates_shadow(self):
+        self.assertTrue(self.oc.set_temperature(50))
+        self.assertNotEqual(self.oc.shadow_state().get('setpoint'), 50)
+        self.oc.read_pushed_status() # Takes in the ack
+        self.assertEqual(self.oc.shadow_state()['setpoint'], 50)
+
+    def test_write_skipped_once_acked(self):
+        self.assertTrue(self.oc.enable())
+        self.assertTrue(self.oc.enable()) # Not acked yet, so sent again
+        self.assertEqual(len(self.sim.writes), 2)
+        self.oc.read_pushed_status()
+        self.assertTrue(self.oc.enable())
+        self.assertEqual(len(self.sim.writes), 2)
+        self.assertTrue(self.oc.enable(force=True))
+        self.assertEqual(len(self.sim.writes), 3)
+
+    def test_unanswered_write_keeps_shadow(self):
+        self.sim.responding = False
+        self.assertTrue(self.oc.enable())
+        self.oc.read_pushed_status()
+        self.assertFalse(self.oc.shadow_state()['enabled'])
+        self.assertTrue(self.oc.enable())
+        self.assertEqual(len(self.sim.writes), 2)
+
+    def test_corrupt_frames_dropped(self):
+        self.assertTrue(self.oc.get_status())
+        status_time = self.oc.status_time
+        self.sim.rx += b'\x01jxx25.0;2\xff\r\n\x01jxx25.0;26\r\n\x01\xff\r\n'
+        self.assertFalse(self.oc.read_pushed_status())
+        self.assertEqual(self.oc.status_time, status_time)
+        self.assertEqual(self.oc.temperature[0], 25.0)
+
+    def test_continuous_output_rate(self):
+        self.assertTrue(self.oc.set_continuous_output(rate=5))
+        for step in range(100):
+            self.clock.sleep(0.1)
+            self.oc.read_pushed_status()
+        self.assertAlmostEqual(self.oc.push_stats.achieved_rate(), 5, delta=0.1)
+        self.assertEqual(self.oc.push_stats.missed(), 0)
+        self.assertEqual(self.oc.push_stats.gaps, 0)
+
+    def test_push_stats_count_from_start(self):
+        self.oc.push_rate = 2
+        self.assertTrue(self.oc.configure(continuous=True))
+        t_start = self.clock.monotonic()
+        self.assertEqual(self.oc.push_stats.t_start, t_start)
+        for step in range(100):
+            self.clock.sleep(0.1)
+            self.oc.read_pushed_status()
+        frames = self.oc.push_stats.frames
+        self.sim.responding = False
+        self.clock.sleep(10)
+        self.assertAlmostEqual(self.oc.push_stats.achieved_rate(), frames / 20)
+        self.assertGreaterEqual(self.oc.push_stats.missed(), 19) # The messages since it went silent
+        self.assertTrue(self.oc.set_continuous_output()) # Already on at 2 Hz, so nothing restarts
+        self.assertEqual(self.oc.push_stats.frames, frames)
+
+    def test_ramp_after_hold_not_too_slow(self):
+        estimator = RampRateEstimator(window=30)
+        self.assertTrue(self.oc.configure(temperature=25, ramp_rate=1, enabled=True))
+        for step in range(60): # Holding at 25 C fills the window with flat data
+            self.clock.sleep(1)
+            self.assertTrue(self.oc.get_status())
+            estimator.update_oc(self.oc)
+        # The step goes in between two samples, so they stay a second apart and the window
+        # stays full
+        self.clock.sleep(1 - self.oc.write_interval)
+        self.assertTrue(self.oc.set_temperature(50))
+        alarms = []
+        for step in range(20): # Still ramping
+            self.assertTrue(self.oc.get_status())
+            estimator.update_oc(self.oc)
+            alarms.append(estimator.too_slow())
+            self.clock.sleep(1)
+        self.assertFalse(any(alarms))
+        self.assertAlmostEqual(estimator.rate(), 1, delta=0.01)
+
+    def test_dead_stream_missed(self):
+        self.sim.responding = False
+        self.assertTrue(self.oc.set_continuous_output(rate=10))
+        self.clock.sleep(1)
+        self.assertFalse(self.oc.read_pushed_status())
+        self.assertEqual(self.oc.push_stats.frames, 0)
+        self.assertEqual(self.oc.push_stats.missed(), 9)
+
+    def test_watchdog_on_oc_clock(self):
+        watchdog = StalenessWatchdog(timeout=3.0, clock=self.clock)
+        watchdog.watch_oc(self.oc, "oc")
+        self.assertTrue(self.oc.get_status())
+        self.clock.sleep(2.9)
+        self.assertEqual(watchdog.advance(), [])
+        self.clock.sleep(0.3)
+        self.assertEqual([event.kind for event in watchdog.advance()], ["stale"])
+        watchdog.unwatch("oc")
+        self.assertEqual(self.oc.status_listeners, [])
+        self.assertTrue(self.oc.get_status())
+        self.clock.sleep(5)
+        self.assertEqual(watchdog.advance(), [])
+        self.assertFalse(watchdog.is_stale("oc"))
+
+    def test_program_runs_on_clock(self):
+        events = []
+        runner = ProgramRunner(on_event=events.append, clock=self.clock)
+        self.oc.enable()
+        runner.add("ramp", self.oc, [Ramp(35, 1, tolerance=0.5)])
+        runner.run()
+        self.assertEqual(events[-1].kind, "finished")
+        self.assertAlmostEqual(self.sim.temp, 35, delta=0.5)
+        self.assertLess(events[-1].time - events[0].time, 15)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,263 @@
+import os
+import select
+import socket
+from collections import namedtuple
+
+import serial
+
+from clock import system_clock
+
+# Serial settings of a connection. The defaults are the OC's.
+PortParams = namedtuple('PortParams', ['baud', 'data_bits', 'stop_bits', 'parity', 'timeout', 'write_timeout'],
+                        defaults=[19200, serial.EIGHTBITS, serial.STOPBITS_ONE, serial.PARITY_EVEN, 1, 1])
+
+# The OC driver talks to its device through a transport: any object with the part of the
+# serial.Serial interface it uses, that is open(), close(), is_open, write(), flush(),
+# in_waiting, read(), read_until() and reset_input_buffer(). make_transport() picks one
+# from the port name:
+#
+#   COM3, /dev/ttyUSB0     a serial port, through pyserial
+#   qt:COM3                a serial port, through Qt's QSerialPort, read as readyRead fires
+#   pty:/dev/pts/4         a local pseudo terminal, e.g. one end of socat or SimulatorLink
+#   tcp://10.0.0.7:4001    a raw TCP socket, e.g. to a serial device server
+#
+# All of them carry the same bytes, so the OC's parsing and write pacing work the same
+# on any of them.
+
+
+def make_transport(port, params=PortParams(), clock=system_clock):
+    # An unopened transport for port
+    name = port.strip()
+    if name.lower().startswith("tcp://"):
+        host, _, number = name[6:].rpartition(':')
+        return TcpTransport(host, int(number), params, clock)
+    if name.lower().startswith("qt:"):
+        return QtSerialTransport(name[3:], params, clock)
+    if name.lower().startswith("pty:"):
+        return PtyTransport(name[4:], params, clock)
+    return SerialTransport(name, params)
+
+
+def is_serial_port(port):
+    # True if port names a serial port, rather than a pty, a socket or the simulator. Only
+    # serial ports are listed by serial.tools.list_ports.
+    name = port.strip().lower()
+    return not name.startswith(("tcp://", "pty:")) and name != "sim"
+
+
+def serial_port_name(port):
+    # The name serial.tools.list_ports gives the serial port, without the qt: prefix
+    name = port.strip()
+    return name[3:] if name.lower().startswith("qt:") else name
+
+
+def serial_device(name):
+    # The path pyserial opens for a port listed by name, e.g. /dev/ttyUSB0 for ttyUSB0. The
+    # port lists give bare names, which pyserial can only open on Windows.
+    if os.name == 'posix' and '/' not in name:
+        return '/dev/' + name
+    return name
+
+
+class SerialTransport(serial.Serial):
+    # A serial port through pyserial, set up but not yet opened
+
+    def __init__(self, port, params=PortParams()):
+        super().__init__()
+        self.baudrate = params.baud
+        self.port = serial_device(port)
+        self.bytesize = params.data_bits
+        self.stopbits = params.stop_bits
+        self.timeout = params.timeout
+        self.write_timeout = params.write_timeout
+
+
+class Transport:
+    # Buffered reading for the transports that are not pyserial. A subclass provides
+    # open(), close(), write() and receive(), which returns whatever bytes have arrived
+    # without blocking. read() and read_until() wait up to the timeout for what they ask
+    # for, as pyserial's do.
+
+    def __init__(self, params=PortParams(), clock=system_clock):
+        self.timeout = params.timeout # [s]
+        self.write_timeout = params.write_timeout # [s]
+        self.clock = clock
+        self.rx = bytearray() # Bytes received and not yet read
+        self.is_open = False
+
+    def receive(self):
+        return b''
+
+    def flush(self):
+        pass
+
+    @property
+    def in_waiting(self):
+        self.rx += self.receive()
+        return len(self.rx)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def wait_for(self, done):
+        # Receive until done() or the timeout
+        deadline = self.clock.monotonic() + self.timeout
+        self.rx += self.receive()
+        while not done() and self.clock.monotonic() < deadline:
+            self.clock.sleep(0.001)
+            self.rx += self.receive()
+
+    def read(self, size=1):
+        self.wait_for(lambda: len(self.rx) >= size)
+        out = bytes(self.rx[:size])
+        del self.rx[:size]
+        return out
+
+    def readall(self):
+        return self.read(self.in_waiting)
+
+    def read_until(self, expected=b'\n', size=None):
+        self.wait_for(lambda: expected in self.rx or (size is not None and len(self.rx) >= size))
+        end = self.rx.find(expected)
+        end = len(self.rx) if end < 0 else end + len(expected)
+        return self.read(end if size is None else min(end, size))
+
+    def reset_input_buffer(self):
+        self.in_waiting
+        self.rx.clear()
+
+
+class TcpTransport(Transport):
+    # A raw TCP connection, as served by serial device servers in raw (not telnet/RFC 2217)
+    # mode. The serial settings are the server's business, only the timeouts are used.
+
+    def __init__(self, host, port, params=PortParams(), clock=system_clock):
+        super().__init__(params, clock)
+        self.address = (host, port)
+        self.socket = None
+
+    def open(self):
+        self.socket = socket.create_connection(self.address, self.timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # Commands are tiny, send them now
+        self.socket.settimeout(self.write_timeout)
+        self.rx.clear()
+        self.is_open = True
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+        self.is_open = False
+
+    def write(self, data):
+        self.socket.sendall(data)
+        return len(data)
+
+    def receive(self):
+        if not self.is_open:
+            return b''
+        received = bytearray()
+        while select.select([self.socket], [], [], 0)[0]:
+            data = self.socket.recv(4096)
+            if not data:
+                self.close()
+                raise serial.SerialException("Connection to %s:%d closed" % self.address)
+            received += data
+        return received
+
+
+class PtyTransport(Transport):
+    # A local pseudo terminal, in raw mode so no bytes are translated. Unix only.
+
+    def __init__(self, path, params=PortParams(), clock=system_clock):
+        super().__init__(params, clock)
+        self.path = path
+        self.fd = None
+
+    def open(self):
+        import tty
+        self.fd = os.open(self.path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(self.fd)
+        self.rx.clear()
+        self.is_open = True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.is_open = False
+
+    def write(self, data):
+        written = 0
+        while written < len(data):
+            select.select([], [self.fd], [], self.write_timeout)
+            written += os.write(self.fd, data[written:])
+        return written
+
+    def receive(self):
+        if not self.is_open:
+            return b''
+        received = bytearray()
+        try:
+            while True:
+                data = os.read(self.fd, 4096)
+                if not data:
+                    break
+                received += data
+        except BlockingIOError:
+            pass
+        return received
+
+
+class QtSerialTransport(Transport):
+    # A serial port through Qt's QSerialPort. Rather than a thread polling the port, Qt's
+    # event loop tells us when bytes arrive (readyRead), and every function in
+    # data_listeners is then called with the transport, e.g. to have the OC parse its
+    # messages there and then. Blocking reads (a status request from the GUI thread) still
+    # work, as receive() lets the port take in what has arrived when its buffer is empty.
+
+    def __init__(self, port, params=PortParams(), clock=system_clock):
+        from PyQt5.QtSerialPort import QSerialPort
+        super().__init__(params, clock)
+        self.port = QSerialPort()
+        self.port.setPortName(port)
+        self.port.setBaudRate(params.baud)
+        self.port.setDataBits(params.data_bits)
+        self.port.setStopBits(QSerialPort.TwoStop if params.stop_bits == serial.STOPBITS_TWO else QSerialPort.OneStop)
+        self.port.readyRead.connect(self.ready_read)
+        self.data_listeners = [] # Called with the transport when bytes arrive
+        self.receiving = False
+        self.open_mode = QSerialPort.ReadWrite
+
+    def open(self):
+        if not self.port.open(self.open_mode):
+            raise serial.SerialException("Could not open %s: %s" % (self.port.portName(), self.port.errorString()))
+        self.rx.clear()
+        self.is_open = True
+
+    def close(self):
+        self.port.close()
+        self.is_open = False
+
+    def write(self, data):
+        written = self.port.write(data)
+        self.port.flush() # Hand it to the OS now, not when control gets back to the event loop
+        return written
+
+    def flush(self):
+        self.port.waitForBytesWritten(int(self.write_timeout * 1000))
+
+    def receive(self):
+        if not self.is_open:
+            return b''
+        if self.port.bytesAvailable() == 0:
+            self.receiving = True # The reader is here already, so readyRead is not passed on
+            self.port.waitForReadyRead(0)
+            self.receiving = False
+        return bytes(self.port.readAll())
+
+    def ready_read(self):
+        if self.receiving:
+            return
+        for listener in self.data_listeners:
+            listener(self)